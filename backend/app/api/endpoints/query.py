@@ -1,19 +1,21 @@
 # backend/app/api/endpoints/query.py
 
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Dict, Optional, Any
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Optional, Any, Tuple, Set
 import pandas as pd
 import re # For simple keyword matching
 import traceback
 import json # Added for direct calc result formatting
+import hashlib
 
 from app.models.api_models import AskRequest, AskResponse
+from app.models.data_models import DocumentChunk
 from app.services.knowledge.search import retrieve_context
-# === ADDED format_context to the import ===
-from app.services.knowledge.llm_interface import generate_answer, format_context
-# ==========================================
+from app.services.knowledge.llm_interface import generate_answer, stream_answer
 from app.services.knowledge.indexer import get_structured_data # Import function to get stored DataFrame
 from app.core.config import settings
+from app.core.state import answer_cache
 
 # --- Tavily Client Initialization ---
 tavily_client = None
@@ -106,6 +108,45 @@ def _attempt_direct_calculation(question: str, session_id: str) -> Optional[str]
     return calculation_result_str
 
 
+# --- Answer Cache ---
+# Repeated questions within a session (reruns, demos) skip retrieval, web search and the LLM call entirely
+def _answer_cache_key(session_id: str, question: str) -> Tuple[str, str]:
+    normalized = " ".join(question.lower().split())
+    return session_id, hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def _get_cached_answer(cache_key: Tuple[str, str]) -> Optional[AskResponse]:
+    cached = answer_cache.get(cache_key)
+    if cached is not None: answer_cache.move_to_end(cache_key); print("[Query Endpoint] Answer cache hit.")
+    return cached
+
+def _store_answer(cache_key: Tuple[str, str], response: AskResponse):
+    if settings.ANSWER_CACHE_MAX_ENTRIES <= 0 or response.type == "error": return # Errors may be transient; retry them
+    answer_cache[cache_key] = response
+    while len(answer_cache) > settings.ANSWER_CACHE_MAX_ENTRIES: answer_cache.popitem(last=False)
+
+# --- Shared Retrieval Steps (used by both the blocking and streaming endpoints) ---
+async def _gather_context(question: str, session_id: str) -> Tuple[List[DocumentChunk], Optional[List[Dict]], Set[str]]:
+    """Runs direct calculation, document retrieval and web search. Returns (doc chunks, web results, sources)."""
+    web_search_results: Optional[List[Dict]] = None
+    search_sources = set()
+
+    # --- 1. Attempt Direct Calculation ---
+    direct_calc_result = _attempt_direct_calculation(question, session_id)
+    if direct_calc_result: search_sources.add("Direct Calculation from Structured Data")
+
+    # --- 2. Retrieve Document Context ---
+    doc_context_chunks = await retrieve_context(question, session_id)
+    if doc_context_chunks:
+        search_sources.update(chunk.source for chunk in doc_context_chunks); print(f"Retrieved {len(doc_context_chunks)} doc chunks.")
+    else: print("No relevant document context found.")
+
+    # --- 3. Perform Web Search ---
+    if tavily_client:
+         web_search_raw = await perform_web_search(question)
+         if web_search_raw: web_search_results = web_search_raw; search_sources.add("Web Search via Tavily")
+
+    return doc_context_chunks, web_search_results, search_sources
+
 # --- Main Query Endpoint ---
 @router.post("/", response_model=AskResponse)
 async def handle_ask_question(request: AskRequest):
@@ -113,50 +154,65 @@ async def handle_ask_question(request: AskRequest):
     print(f"Received question: '{question}' for session: {session_id}")
     if not question or not session_id: raise HTTPException(400, "Missing question or session_id.")
 
-    direct_calc_result: Optional[str] = None
-    web_search_results: Optional[List[Dict]] = None
-    doc_context_chunks: List[DocumentChunk] = []
-    search_sources = set()
+    cache_key = _answer_cache_key(session_id, question)
+    cached_response = _get_cached_answer(cache_key)
+    if cached_response is not None: return cached_response
 
     try:
-        # --- 1. Attempt Direct Calculation ---
-        direct_calc_result = _attempt_direct_calculation(question, session_id)
-        if direct_calc_result: search_sources.add("Direct Calculation from Structured Data")
-
-        # --- 2. Retrieve Document Context ---
-        doc_context_chunks = await retrieve_context(question, session_id)
-        if doc_context_chunks:
-            search_sources.update(chunk.source for chunk in doc_context_chunks); print(f"Retrieved {len(doc_context_chunks)} doc chunks.")
-        else: print("No relevant document context found.")
-
-        # --- 3. Perform Web Search ---
-        if tavily_client:
-             web_search_raw = await perform_web_search(question)
-             if web_search_raw: web_search_results = web_search_raw; search_sources.add("Web Search via Tavily")
-
-        # --- 4. Prepare Context for LLM ---
-        # Use the IMPORTED format_context function
-        final_doc_context_str = format_context(doc_context_chunks) # <--- FIXED IMPORT
-        if direct_calc_result:
-            print("[Query] Prepending direct calculation result to context.")
-            # Add the calculation result prominently
-            final_doc_context_str = f"Direct Calculation Result: {direct_calc_result}\n\n---\n\n{final_doc_context_str}".strip()
-
-        # --- 5. Generate Answer ---
-        # Pass the formatted string context and web results to LLM
-        # Note: The llm_interface needs the formatted strings, not the chunk objects directly for its prompt structure
-        # We pass the chunk objects here mainly for source tracking later if needed, but the prompt uses the formatted strings.
-        llm_result = await generate_answer(question, doc_context_chunks, web_search_results) # Pass original chunks for potential source tracking
+        doc_context_chunks, web_search_results, search_sources = await _gather_context(question, session_id)
+
+        # --- 4. Generate Answer ---
+        # The llm_interface formats the chunks and web results into its prompt itself
+        llm_result = await generate_answer(question, doc_context_chunks, web_search_results)
 
         if llm_result.get("type") == "error": print(f"LLM generation failed: {llm_result.get('answer')}")
 
         # Return final response
-        return AskResponse(
+        response = AskResponse(
             answer=llm_result.get("answer", "Error processing LLM response."),
             type=llm_result.get("type", "error"),
             sources=sorted(list(search_sources)) if llm_result.get("type") != "error" else [],
             data=None, chart_data=None
         )
+        _store_answer(cache_key, response)
+        return response
 
     except HTTPException as http_exc: raise http_exc
-    except Exception as e: print(f"CRITICAL ERROR handling question '{question}': {e}"); traceback.print_exc(); raise HTTPException(500,"Internal server error.")
\ No newline at end of file
+    except Exception as e: print(f"CRITICAL ERROR handling question '{question}': {e}"); traceback.print_exc(); raise HTTPException(500,"Internal server error.")
+
+# --- Streaming Query Endpoint ---
+# Newline-delimited JSON: one {"delta": text} line per generated piece, then a final {"type", "sources"} line
+# (failures are streamed as text too, so the type can only be known at the end)
+_STREAM_HEADERS = {"Content-Encoding": "identity"} # Keeps GZipMiddleware from holding small token chunks back in its buffer
+
+def _ndjson(obj: Dict[str, Any]) -> str: return json.dumps(obj) + "\n"
+
+async def _stream_answer_events(cache_key: Tuple[str, str], question: str, doc_context_chunks: List[DocumentChunk], web_search_results: Optional[List[Dict]], search_sources: Set[str]):
+    outcome: Dict[str, str] = {}; parts: List[str] = []
+    async for piece in stream_answer(question, doc_context_chunks, web_search_results, outcome):
+        parts.append(piece); yield _ndjson({"delta": piece})
+    answer_type = outcome.get("type", "error")
+    if answer_type == "error": print(f"LLM streaming failed for question: '{question}'")
+    response = AskResponse(answer="".join(parts), type=answer_type, sources=sorted(search_sources) if answer_type != "error" else [], data=None, chart_data=None)
+    # Only reached when the stream ran to the end (a client disconnect stops the generator at a yield); errors aren't stored
+    _store_answer(cache_key, response)
+    yield _ndjson({"type": response.type, "sources": response.sources})
+
+@router.post("/stream")
+async def handle_ask_question_stream(request: AskRequest):
+    """Same pipeline as POST /ask, but streams the answer as it is generated (NDJSON, answer type and sources last)."""
+    question = request.question.strip(); session_id = request.session_id
+    print(f"Received streaming question: '{question}' for session: {session_id}")
+    if not question or not session_id: raise HTTPException(400, "Missing question or session_id.")
+
+    cache_key = _answer_cache_key(session_id, question)
+    cached_response = _get_cached_answer(cache_key)
+    if cached_response is not None: # Answered before: send it as a single delta
+        events = [_ndjson({"delta": cached_response.answer}), _ndjson({"type": cached_response.type, "sources": cached_response.sources})]
+        return StreamingResponse(iter(events), media_type="application/x-ndjson", headers=_STREAM_HEADERS)
+
+    try:
+        doc_context_chunks, web_search_results, search_sources = await _gather_context(question, session_id)
+    except Exception as e: print(f"CRITICAL ERROR handling question '{question}': {e}"); traceback.print_exc(); raise HTTPException(500,"Internal server error.")
+
+    return StreamingResponse(_stream_answer_events(cache_key, question, doc_context_chunks, web_search_results, search_sources), media_type="application/x-ndjson", headers=_STREAM_HEADERS)
@@ -1,26 +1,65 @@
 # backend/app/api/endpoints/status.py
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any
+import asyncio
+import json
+import logging
 
 # Import the shared status store from the dedicated state module
-from app.core.state import session_status_store
+from app.core.state import session_status_store, session_status_changed
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+STATUS_EVENT_KEEPALIVE = 5 # Seconds of no change before a comment line (keeps proxies from closing the stream, lets the client's read timeout stay short)
+STATUS_LONG_POLL_MAX = 60 # Upper bound (seconds) on how long ?wait= may hold a request open
 
 @router.get("/{session_id}", response_model=Dict[str, str])
-async def get_session_status(session_id: str):
+async def get_session_status(session_id: str, wait: float = 0):
     """
     Checks the processing status for a given session ID.
+    With ?wait=N (long-poll), holds the request up to N seconds until the status changes.
     """
-    print(f"[Status Endpoint] Checking status for session: {session_id}")
+    logger.debug("[Status Endpoint] Checking status for session: %s", session_id)
     # Access the imported dictionary
     session_info = session_status_store.get(session_id)
+    if wait > 0 and (not session_info or session_info.get("status") == "processing"):
+        # Woken by the next status write (pushed from the background task), or gives up after the wait
+        changed = session_status_changed(session_id)
+        try: await asyncio.wait_for(changed.wait(), timeout=min(wait, STATUS_LONG_POLL_MAX))
+        except asyncio.TimeoutError: pass
+        session_info = session_status_store.get(session_id)
 
     if not session_info:
-        print(f"[Status Endpoint] Session not found or status not yet set: {session_id}")
+        logger.debug("[Status Endpoint] Session not found or status not yet set: %s", session_id)
         # Return processing until the background task explicitly sets 'ready' or 'error'
         return {"status": "processing", "message": "Status unknown or processing..."}
 
     # If session_info WAS found:
-    print(f"[Status Endpoint] Status for {session_id}: {session_info}")
-    return session_info
\ No newline at end of file
+    logger.debug("[Status Endpoint] Status for %s: %s", session_id, session_info)
+    return session_info
+
+@router.get("/{session_id}/events")
+async def stream_session_status(session_id: str, request: Request):
+    """
+    Server-Sent Events stream of the session's status: one `data:` event per change,
+    closed after the terminal 'ready'/'error' event. Replaces repeated GET polling from the frontend.
+    """
+    async def event_source():
+        last_info = None
+        while not await request.is_disconnected():
+            changed = session_status_changed(session_id) # Taken before the read so a write in between still wakes us
+            session_info = session_status_store.get(session_id) or {"status": "processing", "message": "Status unknown or processing..."}
+            if session_info != last_info:
+                last_info = dict(session_info)
+                yield f"data: {json.dumps(last_info)}\n\n"
+                if last_info.get("status") in ("ready", "error"): return
+            # Pushed: sleeps until the background task writes a status, with a keep-alive comment if it stays quiet
+            try: await asyncio.wait_for(changed.wait(), timeout=STATUS_EVENT_KEEPALIVE)
+            except asyncio.TimeoutError: yield ": keep-alive\n\n"
+
+    logger.info("[Status Endpoint] Streaming status events for session: %s", session_id)
+    # Content-Encoding: identity keeps GZipMiddleware from buffering the stream
+    return StreamingResponse(event_source(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"})
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Request, Header, Response
 from typing import List, Dict, Any
-import shutil
+import gzip
+import zlib
 import os
 import uuid
 import asyncio
@@ -14,6 +15,7 @@ from app.services.parser.main_parser import process_document
 from app.services.knowledge.indexer import index_content, clear_session_data, store_structured_data
 from app.services.knowledge.crawler import crawl_and_chunk_url
 from app.models.data_models import DocumentChunk
+from app.core.state import pending_uploads
 # Import state store correctly within the background task function later
 
 router = APIRouter()
@@ -22,7 +24,7 @@ router = APIRouter()
 async def background_process_files(files_data: List[Dict[str, str]], session_id: str):
     print(f"[Background Task:{session_id}] Started.")
     # Import state store inside the async function
-    from app.core.state import session_status_store
+    from app.core.state import session_status_store, set_session_status
 
     all_parsed_chunks: List[DocumentChunk] = []
     extracted_urls: set[str] = set()
@@ -33,7 +35,7 @@ async def background_process_files(files_data: List[Dict[str, str]], session_id:
     final_status = "processing"
 
     # Set initial status
-    session_status_store[session_id] = {"status": "processing", "message": "Parsing files..."}
+    set_session_status(session_id, status="processing", message="Parsing files...")
 
     try:
         # --- Stage 1: Parse Uploaded Files ---
@@ -92,12 +94,12 @@ async def background_process_files(files_data: List[Dict[str, str]], session_id:
 
         # --- Stage 2: Crawl Extracted URLs ---
         if extracted_urls:
-            session_status_store[session_id]["message"] = f"Crawling {len(extracted_urls)} URLs..."
+            set_session_status(session_id, message=f"Crawling {len(extracted_urls)} URLs...")
             print(f"[Background Task:{session_id}] Stage 2: Crawling {len(extracted_urls)} URLs sequentially...")
             url_list = sorted(list(extracted_urls))
             for i, url in enumerate(url_list):
                 if i % 2 == 0: # Update status periodically
-                     session_status_store[session_id]["message"] = f"Crawling URL {i+1}/{len(url_list)}..."
+                     set_session_status(session_id, message=f"Crawling URL {i+1}/{len(url_list)}...")
                 print(f"[Background Task:{session_id}]   Crawling URL {i+1}/{len(url_list)}: {url}")
                 try:
                     url_chunks = await crawl_and_chunk_url(url, session_id, depth=0)
@@ -120,7 +122,7 @@ async def background_process_files(files_data: List[Dict[str, str]], session_id:
         # --- Stage 3: Index Combined Content ---
         final_chunks_to_index = all_parsed_chunks + crawled_chunks
         if final_chunks_to_index:
-            session_status_store[session_id]["message"] = f"Indexing {len(final_chunks_to_index)} chunks..."
+            set_session_status(session_id, message=f"Indexing {len(final_chunks_to_index)} chunks...")
             print(f"[Background Task:{session_id}] Stage 3: Indexing {len(final_chunks_to_index)} total chunks...")
             try:
                 index_success = await index_content(final_chunks_to_index, session_id)
@@ -156,10 +158,35 @@ async def background_process_files(files_data: List[Dict[str, str]], session_id:
         final_status_msg += f" ERRORS: {'; '.join(processing_errors)}"
         final_status = "error" # Ensure status reflects errors
 
-    session_status_store[session_id] = {"status": final_status, "message": final_status_msg}
+    set_session_status(session_id, status=final_status, message=final_status_msg)
     print(f"[Background Task:{session_id}] Final Status Update: {session_status_store[session_id]}")
 
 
+# --- File Saving ---
+def _save_upload_file(session_id: str, file: UploadFile) -> Dict[str, str]:
+    """Saves one uploaded file to UPLOAD_DIR and returns its {"path", "name"} entry for background processing."""
+    safe_filename = os.path.basename(file.filename)
+    temp_file_path = os.path.join(settings.UPLOAD_DIR, f"{session_id}_{safe_filename}")
+    print(f"API: Saving temporary file: {temp_file_path}")
+    # Streamed to disk in 1 MiB blocks (never the whole upload in RAM); parsers then read pages lazily from the file.
+    # Text-like parts may arrive gzipped (per-part Content-Encoding header); they're inflated while copying, and the
+    # inflated size is what counts against MAX_UPLOAD_BYTES (a small gzip part can otherwise expand to GBs on disk).
+    source = gzip.GzipFile(fileobj=file.file, mode="rb") if file.headers.get("content-encoding", "").lower() == "gzip" else file.file
+    written = 0
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            for block in iter(lambda: source.read(1 << 20), b""):
+                written += len(block)
+                if written > settings.MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {settings.MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+                buffer.write(block)
+    except (HTTPException, gzip.BadGzipFile, EOFError, zlib.error) as e:
+        try: os.remove(temp_file_path)
+        except OSError: pass
+        if isinstance(e, HTTPException): raise
+        raise HTTPException(status_code=400, detail=f"Corrupt gzip-encoded upload: {safe_filename}.")
+    return {"path": temp_file_path, "name": safe_filename}
+
 # --- API Endpoint (Remains the same) ---
 @router.post("/", response_model=UploadResponse, status_code=202)
 async def handle_file_upload(
@@ -177,11 +204,13 @@ async def handle_file_upload(
     for file in files:
         if not file.filename: continue
         safe_filename = os.path.basename(file.filename)
-        temp_file_path = os.path.join(settings.UPLOAD_DIR, f"{session_id}_{safe_filename}")
         try:
-            print(f"API: Saving temporary file: {temp_file_path}")
-            with open(temp_file_path, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
-            saved_files_data.append({"path": temp_file_path, "name": safe_filename})
+            saved_files_data.append(_save_upload_file(session_id, file))
+        except HTTPException: # 413 / 400 from the save: drop what was already saved, keep the status code
+            for saved in saved_files_data:
+                try: os.remove(saved["path"])
+                except OSError: pass
+            raise
         except Exception as e:
             for saved in saved_files_data:
                  if os.path.exists(saved["path"]):
@@ -198,3 +227,80 @@ async def handle_file_upload(
 
     return UploadResponse(status="processing", session_id=session_id, message="File processing started.")
 
+# --- Per-File Upload Session ---
+# Lets the client send files as parallel single-file requests into one session, then start processing once.
+@router.post("/session", response_model=UploadResponse, status_code=201)
+async def create_upload_session():
+    session_id = str(uuid.uuid4())
+    await clear_session_data(session_id)
+    pending_uploads[session_id] = []
+    print(f"API: Created upload session: {session_id}")
+    return UploadResponse(status="uploading", session_id=session_id, message="Upload session created.")
+
+@router.post("/session/{session_id}/files", response_model=UploadResponse)
+async def upload_session_file(session_id: str, file: UploadFile = File(...)):
+    if session_id not in pending_uploads: raise HTTPException(status_code=404, detail="Unknown upload session.")
+    if not file.filename: raise HTTPException(status_code=400, detail="File has no name.")
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    # Copied off the event loop so parallel per-file requests actually overlap
+    try: saved = await asyncio.get_running_loop().run_in_executor(None, _save_upload_file, session_id, file)
+    except HTTPException: raise # 413 / 400 from the save
+    except Exception as e: raise HTTPException(status_code=500, detail=f"Could not save file: {file.filename}. Error: {e}")
+    finally: await file.close()
+    # /process may have taken the session while the file was being saved
+    if session_id not in pending_uploads:
+        try: os.remove(saved["path"])
+        except OSError: pass
+        raise HTTPException(status_code=409, detail="Upload session is already processing.")
+    pending_uploads[session_id].append(saved)
+    return UploadResponse(status="uploading", session_id=session_id, message=f"Received {saved['name']}.")
+
+@router.patch("/session/{session_id}/chunk/{filename}", status_code=204)
+async def upload_session_chunk(session_id: str, filename: str, request: Request, upload_offset: int = Header(..., alias="Upload-Offset")):
+    """
+    Appends one raw chunk (tus-style) to a file in the session, so large files go up as several
+    small requests under proxy body-size limits. A wrong Upload-Offset gets 409 with the server's
+    offset, letting the client resume from there instead of restarting the file. The file as a
+    whole is capped at settings.MAX_UPLOAD_BYTES (413 past it).
+    """
+    if session_id not in pending_uploads: raise HTTPException(status_code=404, detail="Unknown upload session.")
+    safe_filename = os.path.basename(filename)
+    if not safe_filename: raise HTTPException(status_code=400, detail="File has no name.")
+    temp_file_path = os.path.join(settings.UPLOAD_DIR, f"{session_id}_{safe_filename}")
+    current_offset = os.path.getsize(temp_file_path) if os.path.exists(temp_file_path) else 0
+    if upload_offset != current_offset:
+        raise HTTPException(status_code=409, detail="Upload-Offset mismatch.", headers={"Upload-Offset": str(current_offset)})
+
+    declared_length = int(request.headers.get("content-length") or 0)
+    if current_offset + declared_length > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {settings.MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    # Request blocks are batched to ~1 MiB and written off the event loop, like _save_upload_file's copy
+    loop = asyncio.get_running_loop(); written = current_offset; batch: List[bytes] = []; batch_bytes = 0
+    buffer = await loop.run_in_executor(None, open, temp_file_path, "ab")
+    try:
+        async for block in request.stream():
+            written += len(block)
+            if written > settings.MAX_UPLOAD_BYTES: # Content-Length may be absent or wrong; the cap holds either way
+                await loop.run_in_executor(None, buffer.truncate, current_offset) # Drop this chunk; the file stays resumable
+                raise HTTPException(status_code=413, detail=f"File exceeds the {settings.MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+            batch.append(block); batch_bytes += len(block)
+            if batch_bytes >= 1 << 20: await loop.run_in_executor(None, buffer.write, b"".join(batch)); batch = []; batch_bytes = 0
+        if batch: await loop.run_in_executor(None, buffer.write, b"".join(batch))
+    finally: await loop.run_in_executor(None, buffer.close)
+    # Registered only after the write, re-checking the session: /process may have taken it during the awaits above
+    session_files = pending_uploads.get(session_id)
+    if session_files is None: raise HTTPException(status_code=409, detail="Upload session is already processing.")
+    if not any(saved["path"] == temp_file_path for saved in session_files): session_files.append({"path": temp_file_path, "name": safe_filename})
+    return Response(status_code=204, headers={"Upload-Offset": str(written)})
+
+@router.post("/session/{session_id}/process", response_model=UploadResponse, status_code=202)
+async def process_upload_session(session_id: str, background_tasks: BackgroundTasks):
+    saved_files_data = pending_uploads.pop(session_id, None)
+    if saved_files_data is None: raise HTTPException(status_code=404, detail="Unknown upload session.")
+    if not saved_files_data: raise HTTPException(status_code=400, detail="No valid files saved.")
+
+    background_tasks.add_task(background_process_files, saved_files_data, session_id)
+    print(f"API: Scheduled background task for session {session_id} with {len(saved_files_data)} file(s).")
+    return UploadResponse(status="processing", session_id=session_id, message="File processing started.")
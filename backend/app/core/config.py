@@ -14,6 +14,7 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str = "AI Document Q&A Backend"
     API_V1_STR: str = "/api/v1"
+    LOG_LEVEL: str = "INFO" # Set to DEBUG to log raw LLM responses / context snippets
 
 
     # --- Web Search Settings ---
@@ -21,20 +22,45 @@ class Settings(BaseSettings):
     # --- LLM Settings ---
     GEMINI_API_KEY: Optional[str] = None
     GEMINI_MODEL_NAME: str = "gemini-2.5-pro-exp-03-25" # Default model
+    LLM_SKIP_EMPTY_CONTEXT: bool = False # Return 'not_found' without calling Gemini when there is no doc or web context
+    MAX_PROMPT_TOKENS: int = 28000 # Prompt budget; lowest-ranked doc chunks are dropped to stay under it (~4 chars/token)
+    ANSWER_CACHE_MAX_ENTRIES: int = 1024 # LRU of /ask answers per (session, normalized question); 0 disables
 
     # --- Storage Paths (relative to project root) ---
     DATA_DIR: str = os.path.join(PROJECT_ROOT_DIR, 'data')
     UPLOAD_DIR: str = os.path.join(DATA_DIR, 'uploaded_files')
     INDEX_DIR: str = os.path.join(DATA_DIR, 'index_store')
+    # Per-file upload cap, enforced across all chunks of a PATCH upload. Matches the frontend's MAX_UPLOAD_BYTES (env var,
+    # default 50 MB), which rejects larger files before sending; raise both together to accept bigger (e.g. >100 MB) files
+    MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    PARSE_CACHE_DIR: str = os.path.join(DATA_DIR, 'parse_cache') # Parsed output keyed by file content hash + parse settings
+    # The parse cache is shared across sessions (Clear Session doesn't drop it), so it is bounded by age and total size
+    PARSE_CACHE_MAX_MB: int = 512 # Oldest entries are evicted above this; 0 disables the cache
+    PARSE_CACHE_TTL_HOURS: int = 24
 
     # --- Embedding & Search Settings ---
     EMBEDDING_MODEL_NAME: str = "all-MiniLM-L6-v2"
     CHUNK_SIZE: int = 500
     CHUNK_OVERLAP: int = 50
     SEARCH_TOP_K: int = 15 # Increased context
+    # HNSW graph parameters for the FAISS index (ANN instead of brute-force Flat search)
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH_MIN: int = 64 # efSearch = max(top_k * 4, this)
+    FAISS_SQ8: bool = True # Store vectors as 8-bit scalar-quantized codes (4x less memory/bandwidth, ~1-2% recall cost)
+    FAISS_SQ8_MIN_TRAIN: int = 256 # SQ8 only when a session's first batch has this many vectors to learn value ranges from
 
     # --- OCR Settings ---
     TESSERACT_CMD: Optional[str] = None
+    TESSERACT_CONFIG: str = "--oem 1 --psm 6" # LSTM engine only (no legacy model load), single uniform text block
+    OCR_MAX_WORKERS: int = 8 # Upper bound on page runs of one scanned PDF OCR'd in parallel (on the PARSE_POOL_WORKERS pool)
+    PARSE_POOL_WORKERS: int = 4 # Processes for chunking / image OCR off the event loop (capped at CPU count)
+    OCR_DPI: int = 150 # Render DPI for scanned PDF pages (rasterize cost scales with DPI^2)
+    OCR_RETRY_DPI: int = 300 # Re-render at this DPI when a page yields too little text at OCR_DPI (0 disables)
+    OCR_RETRY_MIN_CHARS: int = 20
+    OCR_PREPROCESS: bool = True # Grayscale + binarize with OpenCV before Tesseract (clean binary input skips Leptonica's own pass)
+    OCR_ADAPTIVE_THRESHOLD: bool = False # Local (windowed) thresholding instead of global Otsu for very large scans
+    OCR_ADAPTIVE_MIN_PIXELS: int = 4_000_000 # Image area above which OCR_ADAPTIVE_THRESHOLD applies
 
     # --- Crawler Settings ---
     CRAWLER_TIMEOUT: int = 15 # Slightly increased timeout
@@ -47,6 +73,7 @@ if not settings.TAVILY_API_KEY: print("WARNING: TAVILY_API_KEY not set. Web sear
 # Create data directories
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 os.makedirs(settings.INDEX_DIR, exist_ok=True)
+os.makedirs(settings.PARSE_CACHE_DIR, exist_ok=True)
 
 # Validate essential keys
 if not settings.GEMINI_API_KEY:
@@ -1,5 +1,8 @@
 # backend/app/core/state.py
-from typing import Dict, Any
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, Any, Tuple, Optional, List
 
 # --- Simple In-Memory Stores ---
 # WARNING: Lost on server restart! Replace with persistent storage/DB for production.
@@ -7,6 +10,30 @@ from typing import Dict, Any
 # Structure: { session_id: {"status": "processing/ready/error", "message": "Optional details"} }
 session_status_store: Dict[str, Dict[str, str]] = {}
 
+# Structure: { session_id: asyncio.Event } set (and dropped) on each status write, so SSE / long-poll waiters wake on push
+session_status_events: Dict[str, asyncio.Event] = {}
+
+def set_session_status(session_id: str, **fields: str) -> None:
+    """Updates a session's status fields and wakes everyone waiting on it. Call from the event loop thread."""
+    session_status_store.setdefault(session_id, {}).update(fields)
+    event = session_status_events.pop(session_id, None)
+    if event: event.set()
+
+def session_status_changed(session_id: str) -> asyncio.Event:
+    """Event set on the next status write for the session. Take it *before* reading the store so no write is missed."""
+    return session_status_events.setdefault(session_id, asyncio.Event())
+
+# Structure: { session_id: [{"path": saved file path, "name": original name}, ...] } for per-file upload sessions
+# (POST /upload/session, then one POST per file in parallel, then /process)
+pending_uploads: Dict[str, List[Dict[str, str]]] = {}
+
+# Worker processes for CPU-bound parse work (chunking, image OCR) so it doesn't hold the event loop / GIL.
+# Created and shut down in main.py's lifespan; None outside the app, where callers use the default thread executor.
+cpu_pool: Optional[Executor] = None
+
+# Structure: { (session_id, normalized question hash): AskResponse }, least recently used first
+answer_cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+
 # You could potentially move other shared stores here too if needed later
 # e.g., CHUNK_DETAIL_STORE, STRUCTURED_DATA_STORE from indexer.py
 
@@ -6,6 +6,7 @@ import time
 import traceback
 
 from app.core.config import settings
+from app.core import state as app_state
 from app.models.data_models import DocumentChunk
 from app.services.text_splitter import chunk_text
 
@@ -66,7 +67,8 @@ async def crawl_and_chunk_url(url: str, session_id: str, depth: int = 0) -> Opti
 
     if main_text:
         try:
-            split_chunks = chunk_text(main_text)
+            # Chunking is CPU-bound: run it in the app's worker processes, not on the event loop
+            split_chunks = await asyncio.get_running_loop().run_in_executor(app_state.cpu_pool, chunk_text, main_text)
             for text_chunk in split_chunks:
                  parsed_chunks.append(DocumentChunk(session_id=session_id, source=url, text=text_chunk, metadata={"parser": "trafilatura_crawler", "depth": depth}))
             print(f"[Crawler] Created {len(parsed_chunks)} chunks from {url}.")
@@ -3,6 +3,7 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 import os
 import json
+import uuid
 import asyncio
 from typing import List, Dict, Optional, Tuple, Any
 import pandas as pd
@@ -10,6 +11,7 @@ import traceback
 
 from app.models.data_models import DocumentChunk
 from app.core.config import settings
+from app.core.state import answer_cache
 
 # --- Globals ---
 print(f"[Indexer Service] Loading embedding model: {settings.EMBEDDING_MODEL_NAME}")
@@ -45,9 +47,33 @@ async def _get_lock(session_id: str) -> asyncio.Lock:
         index_locks[session_id] = asyncio.Lock()
     return index_locks[session_id]
 
+def _create_faiss_index(first_batch_size: int) -> faiss.Index:
+    """Creates an empty HNSW index (approximate search, ~O(log N) per query instead of a full Flat scan).
+    With FAISS_SQ8 the stored vectors are int8-quantized; such an index must be trained before the first add, and the
+    per-dimension ranges it learns from the first batch clip every later one. A first batch smaller than
+    FAISS_SQ8_MIN_TRAIN can't give usable ranges, so that session keeps full-precision vectors instead."""
+    if settings.FAISS_SQ8 and first_batch_size >= settings.FAISS_SQ8_MIN_TRAIN: index = faiss.IndexHNSWSQ(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, settings.FAISS_HNSW_M)
+    else: index = faiss.IndexHNSWFlat(EMBEDDING_DIM, settings.FAISS_HNSW_M)
+    index.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+    return index
+
 # --- Load Function Modified ---
-def _load_faiss_index_and_data(session_id: str) -> Optional[Tuple[faiss.Index, Dict[int, Dict[str, Any]]]]:
-    """Loads FAISS index and ID->ChunkData mapping for a session."""
+# IO_FLAG_MMAP alone only maps the on-disk inverted lists of IVF indexes, which this module never builds.
+# IO_FLAG_MMAP_IFC (faiss >= 1.8) maps the flat code storage of IndexFlatCodes types in place, which covers the
+# HNSW(SQ) vector storage; the HNSW graph links are still read onto the heap. None on older faiss builds.
+_IO_FLAG_MMAP_CODES = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+def _read_index_mmap(index_file: str) -> faiss.Index:
+    """Reads a search-only index with its vector codes memory-mapped where faiss supports it (page cache, not heap)."""
+    if _IO_FLAG_MMAP_CODES is None: return faiss.read_index(index_file)
+    try:
+        return faiss.read_index(index_file, _IO_FLAG_MMAP_CODES | faiss.IO_FLAG_READ_ONLY)
+    except Exception as e:
+        print(f"[Indexer Service Load] mmap load not supported for {index_file} ({e}); loading into memory.")
+        return faiss.read_index(index_file)
+
+def _load_faiss_index_and_data(session_id: str, read_only: bool = False) -> Optional[Tuple[faiss.Index, Dict[int, Dict[str, Any]]]]:
+    """Loads FAISS index and ID->ChunkData mapping for a session. read_only=True maps the vector codes (search path; it can't be added to)."""
     index_file, mapping_file = _get_session_index_paths(session_id)
     if not os.path.exists(index_file) or not os.path.exists(mapping_file):
         print(f"[Indexer Service Load] Index or mapping file missing for session: {session_id}")
@@ -55,7 +81,7 @@ def _load_faiss_index_and_data(session_id: str) -> Optional[Tuple[faiss.Index, D
 
     try:
         print(f"[Indexer Service Load] Loading index and chunk data for session: {session_id}")
-        index = faiss.read_index(index_file)
+        index = _read_index_mmap(index_file) if read_only else faiss.read_index(index_file)
         with open(mapping_file, 'r', encoding='utf-8') as f:
             # Keys in JSON are strings, convert back to int for FAISS IDs
             mapping_str_keys: Dict[str, Dict[str, Any]] = json.load(f)
@@ -81,7 +107,9 @@ def _save_faiss_index_and_data(session_id: str, index: faiss.Index, id_to_chunk_
     index_file, mapping_file = _get_session_index_paths(session_id)
     try:
         print(f"[Indexer Service Save] Saving index for {session_id} (Size: {index.ntotal})")
-        faiss.write_index(index, index_file)
+        # Written to a temp file and swapped in: a search may have the current file mapped, and truncating it in place would fault
+        tmp_index_file = f"{index_file}.{uuid.uuid4().hex}.tmp"
+        faiss.write_index(index, tmp_index_file); os.replace(tmp_index_file, index_file)
 
         print(f"[Indexer Service Save] Saving chunk data mapping for {session_id} ({len(id_to_chunk_data_map)} items)")
         # Keys in JSON must be strings
@@ -119,18 +147,22 @@ async def index_content(content_chunks: List[DocumentChunk], session_id: str) ->
         # Load existing index/data or create new ones
         load_result = _load_faiss_index_and_data(session_id)
         if load_result: index, id_to_chunk_data_map = load_result; next_id = index.ntotal
-        else: print(f"[Indexer Service] Creating new index & mapping for session: {session_id}"); index = faiss.IndexFlatL2(EMBEDDING_DIM); id_to_chunk_data_map = {}; next_id = 0
+        else: print(f"[Indexer Service] Creating new index & mapping for session: {session_id}"); index = _create_faiss_index(len(content_chunks)); id_to_chunk_data_map = {}; next_id = 0
 
         texts_to_embed = [chunk.text for chunk in content_chunks]
 
         try:
             print(f"[Indexer Service] Generating {len(texts_to_embed)} embeddings...")
-            embeddings = embed_model.encode(texts_to_embed, convert_to_numpy=True, show_progress_bar=False)
+            embeddings = np.ascontiguousarray(embed_model.encode(texts_to_embed, convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
             print("[Indexer Service] Embeddings generated.")
 
             if embeddings.shape[0] > 0:
+                 if not index.is_trained:
+                     # SQ8 learns per-dimension value ranges; train once on the session's first (large enough) batch
+                     print(f"[Indexer Service] Training quantizer on {embeddings.shape[0]} vectors...")
+                     index.train(embeddings)
                  print(f"[Indexer Service] Adding {embeddings.shape[0]} vectors to FAISS index...")
-                 index.add(embeddings.astype(np.float32))
+                 index.add(embeddings)
 
                  # Populate the id_to_chunk_data_map with essential data for retrieval
                  print(f"[Indexer Service] Populating chunk data mapping...")
@@ -165,6 +197,7 @@ async def clear_session_data(session_id: str):
         # Remove from in-memory stores first
         if session_id in STRUCTURED_DATA_STORE: del STRUCTURED_DATA_STORE[session_id]
         if session_id in index_locks: del index_locks[session_id] # Remove lock itself after use
+        for cache_key in [key for key in answer_cache if key[0] == session_id]: del answer_cache[cache_key]
 
         # Remove files from disk
         index_file, mapping_file = _get_session_index_paths(session_id)
@@ -1,14 +1,17 @@
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import json
 import asyncio
 import os
-import traceback
+import re
+import logging
 from collections import defaultdict
 
 from app.core.config import settings
 from app.models.data_models import DocumentChunk
 
+logger = logging.getLogger(__name__)
+
 # --- Globals & Configuration ---
 gemini_model = None
 gemini_client_configured = False
@@ -16,19 +19,43 @@ gemini_client_configured = False
 def configure_gemini_client():
     global gemini_model, gemini_client_configured
     if gemini_client_configured: return
-    print("[LLM Service] Attempting to configure Gemini client...")
-    if not settings.GEMINI_API_KEY: print("WARN: Gemini API Key missing."); gemini_model = None; gemini_client_configured = True; return
+    logger.info("[LLM Service] Attempting to configure Gemini client...")
+    if not settings.GEMINI_API_KEY: logger.warning("Gemini API Key missing."); gemini_model = None; gemini_client_configured = True; return
     try:
         genai.configure(api_key=settings.GEMINI_API_KEY)
         gemini_model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
-        print(f"[LLM Service] Gemini client OK for model: {settings.GEMINI_MODEL_NAME}")
+        logger.info("[LLM Service] Gemini client OK for model: %s", settings.GEMINI_MODEL_NAME)
         gemini_client_configured = True
-    except Exception as e: print(f"ERROR: Failed to configure Gemini: {e}"); gemini_model = None; gemini_client_configured = True
+    except Exception as e: logger.error("Failed to configure Gemini: %s", e); gemini_model = None; gemini_client_configured = True
 
 configure_gemini_client()
 
-def format_context(context_chunks: List[DocumentChunk]) -> str:
+# Phrases the model uses when the context doesn't answer the question; one case-insensitive pass, no .lower() copy
+_NOT_FOUND_RE = re.compile(r"cannot provide a complete answer|provided documents and web search do not contain|information wasn't found", re.IGNORECASE)
+
+# Request constants, built once instead of per call (tuple so they can't be mutated by accident)
+_GENERATION_CONFIG = genai.types.GenerationConfig(
+  temperature=0.7, # Keep slightly higher temp
+)
+_SAFETY_SETTINGS = tuple({"category": c, "threshold": "BLOCK_MEDIUM_AND_ABOVE"} for c in ("HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"))
+
+NO_CONTEXT_ANSWER = "Based on the provided documents and web search, I cannot provide a complete answer to this question."
+_PROMPT_OVERHEAD_CHARS = 2000 # Fixed instruction text in _build_prompt, rounded up
+
+CHARS_PER_TOKEN = 4 # Rough estimate for English text, good enough for budgeting
+
+def format_context(context_chunks: List[DocumentChunk], max_chars: Optional[int] = None) -> str:
     if not context_chunks: return "No relevant context was found in the uploaded documents."
+    if max_chars is not None:
+        # Chunks arrive best-match first, so keep a prefix that fits and drop the tail
+        used = 0; kept = 0
+        for chunk in context_chunks:
+            used += len(chunk.text) + 100 # + per-chunk separator/header overhead
+            if used > max_chars: break
+            kept += 1
+        if kept < len(context_chunks):
+            logger.info("[LLM Service] Clipped document context from %d to %d chunks to fit prompt budget.", len(context_chunks), kept)
+            context_chunks = context_chunks[:kept]
     grouped_by_source = defaultdict(list)
     for chunk in context_chunks:
         source_key = f"{chunk.source}" + (f" (Page approx. {chunk.page})" if chunk.page else "")
@@ -46,12 +73,12 @@ def format_web_results(web_results: Optional[List[Dict[str, str]]]) -> str:
      for result in web_results: i+=1; formatted += f"--- Web Result {i} ---\nTitle: {result.get('title', 'N/A')}\nURL: {result.get('url', 'N/A')}\nSnippet: {result.get('content', 'N/A')}\n\n"
      return formatted.strip()
 
-async def generate_answer(question: str, context_chunks: List[DocumentChunk], web_search_results: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-    if not gemini_client_configured: configure_gemini_client()
-    if not gemini_model: return {"answer": "LLM unavailable.", "type": "error"}
-
-    document_context = format_context(context_chunks)
+def _build_prompt(question: str, context_chunks: List[DocumentChunk], web_search_results: Optional[List[Dict[str, str]]]) -> str:
+    """Builds the grounded Q&A prompt shared by generate_answer and stream_answer."""
     web_context = format_web_results(web_search_results)
+    # Whatever the instructions, web results and question leave of the token budget goes to document context
+    doc_budget_chars = settings.MAX_PROMPT_TOKENS * CHARS_PER_TOKEN - _PROMPT_OVERHEAD_CHARS - len(web_context) - len(question)
+    document_context = format_context(context_chunks, max_chars=max(doc_budget_chars, 0))
 
     # --- **FINAL REFINED PROMPT** ---
     prompt = f"""**Instructions:**
@@ -60,7 +87,7 @@ async def generate_answer(question: str, context_chunks: List[DocumentChunk], we
 - If the question asks for a general explanation or summary (e.g., "explain...", "what is this about?", "summarize..."), provide a **detailed and well-structured** explanation covering the key aspects mentioned in the context. Use multiple paragraphs if necessary and draw connections between different pieces of information found in the context.
 - If the question is specific, provide a precise answer using only facts stated in the context.
 - If the context contains summaries of structured data (like tables), refer to that summary to answer related questions about counts, totals, etc., performing simple calculations if possible from the summary.
-- **Crucially: If the information needed to answer the question accurately and comprehensively is not present in *either* the Document Context or the Web Search Results, state clearly: "Based on the provided documents and web search, I cannot provide a complete answer to this question."** Do not guess or use external knowledge.
+- **Crucially: If the information needed to answer the question accurately and comprehensively is not present in *either* the Document Context or the Web Search Results, state clearly: "{NO_CONTEXT_ANSWER}"** Do not guess or use external knowledge.
 - Do NOT include meta-references like "(Context Chunk X)".
 
 **Document Context:**
@@ -75,37 +102,72 @@ async def generate_answer(question: str, context_chunks: List[DocumentChunk], we
 
 **Answer:**
 """
+    logger.debug("[LLM Service] Doc Context (Start): %s...", document_context[:200]) # Lazy: only formatted at DEBUG
+    logger.debug("[LLM Service] Web Context (Start): %s...", web_context[:200])
+    return prompt
 
-    print(f"[LLM Service] Calling Gemini API (Model: {settings.GEMINI_MODEL_NAME})...")
-    print(f"[LLM Service] Approx. total prompt length: {len(prompt)} chars") # Log prompt length
-    print(f"[LLM Service] Doc Context (Start): {document_context[:200]}...") # Shorter snippet ok
-    print(f"[LLM Service] Web Context (Start): {web_context[:200]}...")
+async def generate_answer(question: str, context_chunks: List[DocumentChunk], web_search_results: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    if not gemini_client_configured: configure_gemini_client()
+    if not gemini_model: return {"answer": "LLM unavailable.", "type": "error"}
+
+    # Nothing to ground an answer in: the model would only produce the "cannot answer" fallback, so skip the round-trip
+    if settings.LLM_SKIP_EMPTY_CONTEXT and not context_chunks and not web_search_results:
+        logger.info("[LLM Service] No document or web context; skipping Gemini call.")
+        return {"answer": NO_CONTEXT_ANSWER, "type": "not_found", "data": None, "chart_data": None}
 
-    generation_config = genai.types.GenerationConfig(
-      temperature=0.7, # Keep slightly higher temp
-    )
-    safety_settings = [ {"category": c, "threshold": "BLOCK_MEDIUM_AND_ABOVE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
+    prompt = _build_prompt(question, context_chunks, web_search_results)
+
+    logger.info("[LLM Service] Calling Gemini API (Model: %s)...", settings.GEMINI_MODEL_NAME)
+    logger.info("[LLM Service] Approx. total prompt length: %d chars", len(prompt)) # Log prompt length
 
     try:
         loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: gemini_model.generate_content(prompt, generation_config=generation_config, safety_settings=safety_settings))
+        response = await loop.run_in_executor(None, lambda: gemini_model.generate_content(prompt, generation_config=_GENERATION_CONFIG, safety_settings=_SAFETY_SETTINGS))
 
         raw_response_text = "[No response text]"; answer = ""; answer_type = "error"
         try:
-            raw_response_text = response.text
-            print(f"[LLM Service] Raw response: {raw_response_text!r}")
+            # Check the block reason first: .text raises on a blocked response and is recomputed on every access
             if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason: raise ValueError(f"Blocked: {response.prompt_feedback.block_reason}")
             if response.candidates and response.candidates[0].content.parts:
-                 answer = response.text.strip()
+                 raw_response_text = response.text
+                 if logger.isEnabledFor(logging.DEBUG): logger.debug("[LLM Service] Raw response: %r", raw_response_text[:512])
+                 answer = raw_response_text.strip()
                  if not answer: answer_type = "not_found"; answer = "LLM returned empty answer."
-                 elif "cannot provide a complete answer" in answer.lower() or \
-                      "provided documents and web search do not contain" in answer.lower() or \
-                      "information wasn't found" in answer.lower(): answer_type = "not_found"
+                 elif _NOT_FOUND_RE.search(answer): answer_type = "not_found"
                  else: answer_type = "text"
             else: raise ValueError(f"No valid candidate. Reason: {response.candidates[0].finish_reason if response.candidates else 'Unknown'}")
-        except (ValueError, AttributeError, Exception) as e: print(f"[LLM Service] WARN processing response: {e}"); answer = f"Error processing LLM response: {e}"; answer_type="error"
+        except (ValueError, AttributeError, Exception) as e: logger.warning("[LLM Service] Problem processing response: %s", e); answer = f"Error processing LLM response: {e}"; answer_type="error"
 
         return {"answer": answer, "type": answer_type, "data": None, "chart_data": None}
 
-    except Exception as e: print(f"[LLM Service] ERROR Gemini call failed: {e}"); traceback.print_exc(); return {"answer": "Error communicating with LLM.", "type": "error"}
+    except Exception as e: logger.error("[LLM Service] Gemini call failed: %s", e, exc_info=True); return {"answer": "Error communicating with LLM.", "type": "error"}
 
+async def stream_answer(question: str, context_chunks: List[DocumentChunk], web_search_results: Optional[List[Dict[str, str]]] = None, outcome: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """Streams the answer text as Gemini generates it. Same prompt and settings as generate_answer.
+    Failures are yielded as text too, so the final answer type ('text' / 'not_found' / 'error') goes into outcome["type"]."""
+    outcome = {} if outcome is None else outcome
+    if not gemini_client_configured: configure_gemini_client()
+    if not gemini_model: outcome["type"] = "error"; yield "LLM unavailable."; return
+
+    if settings.LLM_SKIP_EMPTY_CONTEXT and not context_chunks and not web_search_results:
+        logger.info("[LLM Service] No document or web context; skipping Gemini call.")
+        outcome["type"] = "not_found"; yield NO_CONTEXT_ANSWER; return
+
+    prompt = _build_prompt(question, context_chunks, web_search_results)
+    logger.info("[LLM Service] Streaming from Gemini API (Model: %s), prompt length: %d chars", settings.GEMINI_MODEL_NAME, len(prompt))
+
+    parts: List[str] = []
+    try:
+        response = await gemini_model.generate_content_async(prompt, generation_config=_GENERATION_CONFIG, safety_settings=_SAFETY_SETTINGS, stream=True)
+        async for chunk in response:
+            # Blocked / empty chunks carry no parts and .text raises on them; safety is judged on the aggregate below
+            if chunk.candidates and chunk.candidates[0].content.parts: parts.append(chunk.text); yield parts[-1]
+        if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+            logger.warning("[LLM Service] Streamed response blocked: %s", response.prompt_feedback.block_reason)
+            outcome["type"] = "error"; yield f"\n\n[Response blocked: {response.prompt_feedback.block_reason}]"; return
+    except Exception as e:
+        logger.error("[LLM Service] Gemini streaming call failed: %s", e, exc_info=True)
+        outcome["type"] = "error"; yield "\n\nError communicating with LLM."; return
+    # Same classification as generate_answer, on the assembled text
+    answer = "".join(parts).strip()
+    outcome["type"] = "not_found" if not answer or _NOT_FOUND_RE.search(answer) else "text"
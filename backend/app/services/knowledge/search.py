@@ -18,7 +18,7 @@ async def retrieve_context(question: str, session_id: str, top_k: int = settings
         return []
 
     # 1. Load the index AND the chunk data mapping
-    load_result = _load_faiss_index_and_data(session_id)
+    load_result = _load_faiss_index_and_data(session_id, read_only=True) # mmapped: search never mutates the index
     if not load_result:
         print(f"[Search Service] Index/mapping not found or failed to load for session {session_id}.")
         return []
@@ -28,10 +28,15 @@ async def retrieve_context(question: str, session_id: str, top_k: int = settings
          print(f"[Search Service] Index for session {session_id} is empty.")
          return []
 
+    # HNSW indexes trade recall for speed via efSearch; older Flat indexes on disk have no such knob
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = max(top_k * 4, settings.FAISS_HNSW_EF_SEARCH_MIN)
+
     # 2. Generate query embedding
     try:
         print("[Search Service] Generating query embedding...")
-        query_embedding = embed_model.encode([question], convert_to_numpy=True, show_progress_bar=False)
+        # encode() already yields float32; ascontiguousarray only copies if dtype/layout don't match what FAISS needs
+        query_embedding = np.ascontiguousarray(embed_model.encode([question], convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
         print("[Search Service] Query embedding generated.")
     except Exception as e:
         print(f"[Search Service] ERROR generating query embedding: {e}")
@@ -40,7 +45,7 @@ async def retrieve_context(question: str, session_id: str, top_k: int = settings
     # 3. Search the FAISS index
     try:
         print(f"[Search Service] Searching index (size {index.ntotal}) for top {top_k} results...")
-        distances, faiss_ids = index.search(query_embedding.astype(np.float32), k=min(top_k, index.ntotal)) # Search for k or ntotal if smaller
+        distances, faiss_ids = index.search(query_embedding, k=min(top_k, index.ntotal)) # Search for k or ntotal if smaller
         print(f"[Search Service] Search complete. Found indices: {faiss_ids}")
 
     except Exception as e:
@@ -52,28 +57,29 @@ async def retrieve_context(question: str, session_id: str, top_k: int = settings
     if faiss_ids.size > 0:
         retrieved_ids = faiss_ids[0] # Results for the first (only) query vector
         print(f"[Search Service] Processing retrieved FAISS IDs: {retrieved_ids}")
-        for faiss_id in retrieved_ids:
-            if faiss_id == -1: continue # Skip invalid IDs
-
-            chunk_data = id_to_chunk_data_map.get(faiss_id) # Look up data using FAISS ID
-            if chunk_data:
-                try:
-                    # Reconstruct DocumentChunk object from the retrieved dictionary
-                    # Use .get() for potentially missing keys like 'page' or 'metadata'
-                    chunk_obj = DocumentChunk(
-                        session_id=session_id, # Add session_id back if needed downstream
-                        chunk_id=chunk_data.get("chunk_id", f"faiss_{faiss_id}"), # Use original or generate one
-                        text=chunk_data.get("text", ""),
-                        source=chunk_data.get("source", "Unknown Source"),
-                        page=chunk_data.get("page"),
-                        metadata=chunk_data.get("metadata", {}),
-                        # Embedding is not stored in the map, don't include it here
-                    )
-                    relevant_chunks.append(chunk_obj)
-                except Exception as deser_err:
-                     print(f"[Search Service] ERROR reconstructing DocumentChunk for FAISS ID {faiss_id}: {deser_err}")
-            else:
-                print(f"[Search Service] Warning: Could not find chunk data in mapping for FAISS ID {faiss_id} (Session: {session_id})")
+        valid_ids = retrieved_ids[retrieved_ids != -1].tolist() # Drop invalid (-1) IDs in one NumPy pass
+        _get_chunk_data = id_to_chunk_data_map.get # Hoisted out of the comprehension
+        try:
+            # Reconstruct DocumentChunk objects from the retrieved dictionaries
+            # Use .get() for potentially missing keys like 'page' or 'metadata'; embedding is not stored in the map
+            # model_construct skips validation: this data was validated as DocumentChunks when it was indexed
+            relevant_chunks = [
+                DocumentChunk.model_construct(
+                    session_id=session_id, # Add session_id back if needed downstream
+                    chunk_id=chunk_data.get("chunk_id", f"faiss_{faiss_id}"), # Use original or generate one
+                    text=chunk_data.get("text", ""),
+                    source=chunk_data.get("source", "Unknown Source"),
+                    page=chunk_data.get("page"),
+                    metadata=chunk_data.get("metadata", {}),
+                )
+                for faiss_id in valid_ids
+                if (chunk_data := _get_chunk_data(faiss_id))
+            ]
+        except Exception as deser_err:
+            print(f"[Search Service] ERROR reconstructing DocumentChunks for session {session_id}: {deser_err}")
+            relevant_chunks = []
+        if len(relevant_chunks) < len(valid_ids):
+            print(f"[Search Service] Warning: {len(valid_ids) - len(relevant_chunks)} FAISS ID(s) had no chunk data in mapping (Session: {session_id})")
 
     print(f"[Search Service] Retrieved {len(relevant_chunks)} relevant chunk details from mapping.")
     # --- get_chunk_details call REMOVED ---
@@ -1,65 +1,225 @@
 import os
+import sys
 import uuid
-from typing import List, Dict, Any, Tuple, Optional
-import io # For pandas reading in-memory
+from typing import List, Dict, Any, Tuple, Optional, Set, Iterator
 import json
+import mmap
+import asyncio
+import hashlib
+import pickle
+import tempfile
+import time
+import traceback
+from itertools import repeat
 
 # Parsing Libraries
-from pypdf import PdfReader
-import docx
-from pptx import Presentation # For PPTX
+# pypdf, python-docx, python-pptx and pdf2image are imported inside the functions that use them, so startup
+# (and a .txt-only upload) doesn't pay for them. pandas stays here: the indexer and endpoints load it anyway.
 import pandas as pd # For CSV, XLSX, JSON
 
 # OCR & Image Handling
 from PIL import Image
-from pdf2image import convert_from_path
-from pdf2image.exceptions import PDFInfoNotInstalledError
+
+# PyArrow's multi-threaded CSV/NDJSON readers are much faster on large files; pandas' default engines are the fallback
+try:
+    import pyarrow.json as pa_json
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa_json = None
+    PYARROW_AVAILABLE = False
+
+# PyMuPDF renders and extracts text in-process (no pdftoppm subprocess, one parse per PDF); pypdf/pdf2image are the fallback
+try:
+    import pymupdf
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    pymupdf = None
+    PYMUPDF_AVAILABLE = False
 
 # Local Imports
 from app.models.data_models import DocumentChunk
-from app.services.parser.ocr import perform_ocr
-from app.services.text_splitter import chunk_text, extract_urls
+from app.services.parser.ocr import perform_ocr, perform_ocr_batch, tesseract_engine, OCR_AVAILABLE
+from app.services.text_splitter import chunk_text, split_and_extract
 from app.core.config import settings
+from app.core import state as app_state
+
+async def _run_cpu_bound(func, *args):
+    """Runs CPU-bound work (chunking, OCR) in the app's worker-process pool so the event loop keeps serving requests."""
+    return await asyncio.get_running_loop().run_in_executor(app_state.cpu_pool, func, *args)
+
+# --- PDF OCR Workers ---
+def _needs_ocr_retry(ocr_text: str) -> bool:
+    """True if a page rendered at OCR_DPI gave too little text to trust (small print needs more pixels)."""
+    return settings.OCR_RETRY_DPI > settings.OCR_DPI and len(ocr_text.strip()) < settings.OCR_RETRY_MIN_CHARS
+
+def _ocr_doc_page(doc, page_num: int, dpi: int, engine) -> str:
+    pix = doc[page_num].get_pixmap(dpi=dpi) # RGB, no alpha
+    return perform_ocr(Image.frombytes("RGB", (pix.width, pix.height), pix.samples), engine=engine) or ""
+
+def _ocr_pages_from_doc(doc, page_nums) -> List[Tuple[int, str]]:
+    """Renders pages of an already-open PyMuPDF document and OCRs them."""
+    results = []
+    with tesseract_engine() as engine: # One engine for all pages instead of one startup per page
+        for page_num in page_nums:
+            ocr_text = _ocr_doc_page(doc, page_num, settings.OCR_DPI, engine)
+            if _needs_ocr_retry(ocr_text): ocr_text = _ocr_doc_page(doc, page_num, settings.OCR_RETRY_DPI, engine) or ocr_text
+            results.append((page_num, ocr_text))
+    return results
+
+def _ocr_pdf_page_range(file_path: str, first_page: int, last_page: int, thread_count: int) -> List[Tuple[int, str]]:
+    """Rasterizes a contiguous (0-based, inclusive) page range and OCRs each page.
+    Uses PyMuPDF if installed, otherwise one poppler call for the range. Module-level so the cpu_pool can pickle it."""
+    if PYMUPDF_AVAILABLE:
+        with pymupdf.open(file_path) as doc: return _ocr_pages_from_doc(doc, range(first_page, last_page + 1))
+    from pdf2image import convert_from_path
+    # output_folder keeps rendered pages on disk (loaded lazily) instead of holding the whole range in RAM
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images = convert_from_path(file_path, dpi=settings.OCR_DPI, first_page=first_page + 1, last_page=last_page + 1, fmt='jpeg', thread_count=thread_count, output_folder=tmp_dir)
+        results = []
+        for i, ocr_text in enumerate(perform_ocr_batch(images)): # One Tesseract start-up for the whole run
+            page = first_page + i + 1 # 1-based for poppler
+            if _needs_ocr_retry(ocr_text):
+                retry_images = convert_from_path(file_path, dpi=settings.OCR_RETRY_DPI, first_page=page, last_page=page, fmt='jpeg', thread_count=thread_count, output_folder=tmp_dir)
+                if retry_images: ocr_text = perform_ocr(retry_images[0]) or ocr_text
+            results.append((page - 1, ocr_text))
+        return results
+
+def _contiguous_runs(page_nums: List[int], max_run_length: int) -> List[Tuple[int, int]]:
+    """Groups sorted page numbers into (first, last) runs of consecutive pages, each at most max_run_length long."""
+    runs: List[Tuple[int, int]] = []
+    for page_num in page_nums:
+        if runs and page_num == runs[-1][1] + 1 and page_num - runs[-1][0] < max_run_length: runs[-1] = (runs[-1][0], page_num)
+        else: runs.append((page_num, page_num))
+    return runs
+
+_POPPLER_AVAILABLE: Optional[bool] = None # Probed once per process
+
+def _poppler_available(file_path: str) -> bool:
+    """Checks for poppler with `pdfinfo` (metadata only, no page rasterization); the result is cached for the process."""
+    global _POPPLER_AVAILABLE
+    if _POPPLER_AVAILABLE is None:
+        from pdf2image import pdfinfo_from_path
+        from pdf2image.exceptions import PDFInfoNotInstalledError
+        try: pdfinfo_from_path(file_path); _POPPLER_AVAILABLE = True
+        except (PDFInfoNotInstalledError, FileNotFoundError): _POPPLER_AVAILABLE = False
+        except Exception: return True # Poppler ran but disliked this file; don't cache, let the render report it
+    return _POPPLER_AVAILABLE
+
+def _ocr_pool_size() -> int:
+    """Parallel OCR runs per PDF: the app's cpu_pool size (PARSE_POOL_WORKERS), further capped by OCR_MAX_WORKERS."""
+    if app_state.cpu_pool is None: return 1 # Outside the app: OCR inline
+    return max(1, min(os.cpu_count() or 1, settings.OCR_MAX_WORKERS, settings.PARSE_POOL_WORKERS))
+
+def _log_ocr_results(page_results: List[Tuple[int, str]]):
+    for page_num, ocr_text in page_results:
+        if ocr_text: print(f"[Parser] Page {page_num+1}: OCR successful.")
+        else: print(f"[Parser] Page {page_num+1}: OCR yielded no text.")
+
+def _ocr_pdf_pages(file_path: str, page_nums: List[int]) -> Dict[int, str]:
+    """OCRs the given (0-based) pages across the app's cpu_pool; pages are independent and OCR is CPU-bound.
+    Runs on a default-executor thread, so it blocks on the pool's results instead of awaiting them."""
+    from pdf2image.exceptions import PDFInfoNotInstalledError
+    results: Dict[int, str] = {}
+    if not OCR_AVAILABLE:
+        print(f"[Parser] WARNING: Tesseract not available - Skipping OCR for {len(page_nums)} PDF page(s).")
+        return results
+    if not PYMUPDF_AVAILABLE and not _poppler_available(file_path):
+        # Fail fast instead of spawning workers that would each hit the missing binary
+        print("[Parser] WARNING: Poppler not installed - Skipping OCR for PDF pages.")
+        return results
+    cpu_count = os.cpu_count() or 1
+    pool_size = _ocr_pool_size()
+    # Contiguous runs are rendered by a single pdftoppm invocation; split so every worker gets a share
+    runs = _contiguous_runs(sorted(page_nums), max_run_length=-(-len(page_nums) // pool_size))
+    max_workers = min(pool_size, len(runs))
+    # Spare cores (if fewer runs than cores) go to poppler's own rendering threads
+    poppler_threads = max(1, (cpu_count - 1) // max_workers)
+    print(f"[Parser] OCR for {len(page_nums)} page(s) in {len(runs)} run(s) on {max_workers} pool worker(s), {poppler_threads} render thread(s) each...")
+    try:
+        if max_workers == 1:
+            # A single run gains nothing from a pool; skip the round trip to a worker
+            for first, last in runs:
+                page_results = _ocr_pdf_page_range(file_path, first, last, poppler_threads)
+                _log_ocr_results(page_results); results.update(page_results)
+            return results
+        # The shared worker processes from main.py's lifespan (no pool spawned per document). Rendered page images
+        # never leave the workers (only text comes back), so parent memory stays flat
+        run_results = app_state.cpu_pool.map(_ocr_pdf_page_range, repeat(file_path), [first for first, _ in runs], [last for _, last in runs], repeat(poppler_threads))
+        for page_results in run_results:
+            _log_ocr_results(page_results); results.update(page_results)
+    except PDFInfoNotInstalledError:
+        print("[Parser] WARNING: Poppler not installed - Skipping OCR for PDF pages.")
+    except Exception as ocr_err:
+        print(f"[Parser] Error during parallel PDF OCR: {ocr_err}")
+    return results
 
 # --- PDF Parsing ---
+def _read_pdf_pages(file_path: str) -> Tuple[int, Dict[int, str], List[int]]:
+    """Extracts each page's text layer and OCRs pages that have none (blocking; run in an executor).
+    Returns (page count, {page_num: text}, page_nums that needed OCR)."""
+    page_contents: Dict[int, str] = {}
+    ocr_pages: List[int] = []
+    if PYMUPDF_AVAILABLE:
+        with pymupdf.open(file_path) as doc:
+            num_pages = doc.page_count
+            for page_num, page in enumerate(doc):
+                try:
+                    page_text = page.get_text()
+                    if page_text and page_text.strip(): page_contents[page_num] = page_text
+                    else: ocr_pages.append(page_num)
+                except Exception as page_err: print(f"[Parser] Error processing page {page_num+1}: {page_err}")
+            if ocr_pages and OCR_AVAILABLE and (len(ocr_pages) == 1 or _ocr_pool_size() == 1):
+                # Nothing to parallelize: render from the document that's already parsed instead of reopening it
+                try:
+                    page_results = _ocr_pages_from_doc(doc, ocr_pages)
+                    _log_ocr_results(page_results)
+                    page_contents.update({page_num: text for page_num, text in page_results if text})
+                except Exception as ocr_err: print(f"[Parser] Error during PDF OCR: {ocr_err}")
+                return num_pages, page_contents, ocr_pages
+    else:
+        from pypdf import PdfReader
+        # mmap is itself a seekable stream: pypdf reads objects straight from the page cache, no buffered copy of the file
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            reader = PdfReader(mm, strict=False) # Lenient: no repair/validation passes on slightly malformed PDFs
+            num_pages = len(reader.pages)
+            # Iterate the page collection directly rather than re-resolving reader.pages[i] from the page tree each time
+            for page_num, page in enumerate(reader.pages):
+                try:
+                    page_text = page.extract_text() # Default "plain" mode, not the heavier layout analyzer
+                    if page_text and page_text.strip(): page_contents[page_num] = page_text
+                    else: ocr_pages.append(page_num)
+                except Exception as page_err: print(f"[Parser] Error processing page {page_num+1}: {page_err}")
+
+    if ocr_pages:
+        ocr_results = _ocr_pdf_pages(file_path, ocr_pages)
+        page_contents.update({page_num: text for page_num, text in ocr_results.items() if text})
+    return num_pages, page_contents, ocr_pages
+
+def _iter_pdf_chunks(page_contents: Dict[int, str], ocr_attempted_pages: Set[int], original_name: str, session_id: str, urls: Set[str]) -> Iterator[DocumentChunk]:
+    """Yields chunks page by page in page order, dropping each page's raw text from page_contents once it is chunked
+    so the full document text and the full chunk list are never both held. Each page's URLs are added to urls."""
+    source = sys.intern(original_name)
+    for page_num in sorted(page_contents):
+        page_content = page_contents.pop(page_num)
+        # One read-only metadata dict shared by all chunks of the page; model_construct keeps the reference
+        # (validation would copy it per chunk) and the fields here are built by us, so there is nothing to validate
+        page_metadata = {"parser": "pdf", "ocr_attempted": page_num in ocr_attempted_pages}
+        split_chunks, page_urls = split_and_extract(page_content)
+        urls.update(page_urls)
+        for text_chunk in split_chunks:
+            yield DocumentChunk.model_construct(session_id=session_id, source=source, text=text_chunk, page=page_num + 1, metadata=page_metadata)
+
 async def _parse_pdf(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str]]:
     chunks = []
     urls = set()
-    poppler_available = True # Assume available unless check fails
     try:
-        # Optional: Poppler check (can be slow)
-        # try: convert_from_path(file_path, first_page=1, last_page=1); print("[Parser] Poppler available.")
-        # except Exception: poppler_available = False; print("[Parser] WARNING: Poppler not found/working. OCR fallback skipped.")
-        pass # Skip check for speed for now
-
-        reader = PdfReader(file_path)
-        num_pages = len(reader.pages)
-        print(f"[Parser] Processing PDF: {original_name}, Pages: {num_pages}")
-        for page_num in range(num_pages):
-            page_content = ""; ocr_attempted = False
-            try:
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text and page_text.strip(): page_content = page_text
-                elif poppler_available: # Try OCR only if text extraction fails and poppler *might* be there
-                    print(f"[Parser] Page {page_num+1}: No text found, attempting OCR...")
-                    ocr_attempted = True
-                    images = convert_from_path(file_path, dpi=200, first_page=page_num + 1, last_page=page_num + 1, fmt='jpeg', thread_count=1)
-                    if images: ocr_text = perform_ocr(images[0]); page_content = ocr_text or ""
-                    if page_content: print(f"[Parser] Page {page_num+1}: OCR successful.")
-                    else: print(f"[Parser] Page {page_num+1}: OCR yielded no text.")
-                else: print(f"[Parser] Page {page_num+1}: No text found, OCR skipped (Poppler unavailable?).")
-
-            except PDFInfoNotInstalledError: # Catch specific poppler error here
-                 print("[Parser] WARNING: Poppler not installed - Skipping OCR attempt for PDF page.")
-                 poppler_available = False # Don't try again for this PDF
-            except Exception as page_err: print(f"[Parser] Error processing page {page_num+1}: {page_err}")
-
-            if page_content:
-                page_urls = extract_urls(page_content); urls.update(page_urls)
-                split_chunks = chunk_text(page_content)
-                for text_chunk in split_chunks:
-                    chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, page=page_num + 1, metadata={"parser": "pdf", "ocr_attempted": ocr_attempted}))
+        loop = asyncio.get_running_loop()
+        num_pages, page_contents, ocr_pages = await loop.run_in_executor(None, _read_pdf_pages, file_path)
+        print(f"[Parser] Processed PDF: {original_name}, Pages: {num_pages}, OCR pages: {len(ocr_pages)} ({'PyMuPDF' if PYMUPDF_AVAILABLE else 'pypdf'})")
+        ocr_attempted_pages = set(ocr_pages)
+        # Chunked in a thread, not the process pool: the generator frees page text as it goes, shipping it to
+        # another process would copy the whole document instead
+        chunks = await loop.run_in_executor(None, lambda: list(_iter_pdf_chunks(page_contents, ocr_attempted_pages, original_name, session_id, urls)))
     except Exception as e: print(f"[Parser] ERROR Failed to process PDF {original_name}: {e}"); traceback.print_exc()
     return chunks, list(urls)
 
@@ -67,12 +227,16 @@ async def _parse_pdf(file_path: str, original_name: str, session_id: str) -> Tup
 async def _parse_docx(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str]]:
     chunks = []; urls = set()
     try:
-        doc = docx.Document(file_path); print(f"[Parser] Processing DOCX: {original_name}")
-        full_text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+        loop = asyncio.get_running_loop()
+        import docx
+        doc = await loop.run_in_executor(None, docx.Document, file_path); print(f"[Parser] Processing DOCX: {original_name}")
+        # para.text re-joins the paragraph's runs on every access, so read it once; isspace() avoids strip()'s copy
+        paragraph_texts = (para.text for para in doc.paragraphs)
+        full_text = "\n".join(text for text in paragraph_texts if text and not text.isspace())
         # TODO: Could potentially extract text from tables as well
         if full_text:
-            urls.update(extract_urls(full_text))
-            split_chunks = chunk_text(full_text)
+            split_chunks, text_urls = await _run_cpu_bound(split_and_extract, full_text)
+            urls.update(text_urls)
             for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": "docx"}))
     except Exception as e: print(f"[Parser] ERROR Failed to read DOCX {original_name}: {e}")
     return chunks, list(urls)
@@ -81,7 +245,9 @@ async def _parse_docx(file_path: str, original_name: str, session_id: str) -> Tu
 async def _parse_pptx(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str]]:
     chunks = []; urls = set()
     try:
-        prs = Presentation(file_path); print(f"[Parser] Processing PPTX: {original_name}")
+        loop = asyncio.get_running_loop()
+        from pptx import Presentation
+        prs = await loop.run_in_executor(None, Presentation, file_path); print(f"[Parser] Processing PPTX: {original_name}")
         full_text = ""
         for i, slide in enumerate(prs.slides):
             slide_text = f"--- Slide {i+1} ---\n"
@@ -94,21 +260,25 @@ async def _parse_pptx(file_path: str, original_name: str, session_id: str) -> Tu
             full_text += slide_text + "\n"
 
         if full_text:
-            urls.update(extract_urls(full_text))
-            split_chunks = chunk_text(full_text) # Chunk the entire presentation text
+            split_chunks, text_urls = await _run_cpu_bound(split_and_extract, full_text) # Chunk the entire presentation text
+            urls.update(text_urls)
             for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": "pptx"}))
     except Exception as e: print(f"[Parser] ERROR Failed to read PPTX {original_name}: {e}")
     return chunks, list(urls)
 
 # --- TXT Parsing ---
+def _read_text_file(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f: return f.read()
+
 async def _parse_txt(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str]]:
     chunks = []; urls = set()
     try:
         print(f"[Parser] Processing TXT: {original_name}")
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f: full_text = f.read()
+        loop = asyncio.get_running_loop()
+        full_text = await loop.run_in_executor(None, _read_text_file, file_path) # Don't block the event loop on large files
         if full_text:
-            urls.update(extract_urls(full_text))
-            split_chunks = chunk_text(full_text)
+            split_chunks, text_urls = await _run_cpu_bound(split_and_extract, full_text)
+            urls.update(text_urls)
             for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": "text"}))
     except Exception as e: print(f"[Parser] ERROR Failed to read TXT {original_name}: {e}")
     return chunks, list(urls)
@@ -117,10 +287,10 @@ async def _parse_txt(file_path: str, original_name: str, session_id: str) -> Tup
 async def _parse_image(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str]]:
     chunks = []; urls = set()
     print(f"[Parser] Processing Image for OCR: {original_name}")
-    ocr_text = perform_ocr(file_path)
+    ocr_text = await _run_cpu_bound(perform_ocr, file_path)
     if ocr_text:
-        urls.update(extract_urls(ocr_text))
-        split_chunks = chunk_text(ocr_text)
+        split_chunks, text_urls = await _run_cpu_bound(split_and_extract, ocr_text)
+        urls.update(text_urls)
         for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": "ocr"}))
     else: print(f"[Parser] No text extracted via OCR from {original_name}")
     return chunks, list(urls)
@@ -129,39 +299,51 @@ async def _parse_image(file_path: str, original_name: str, session_id: str) -> T
 def generate_df_summary(df: pd.DataFrame, filename: str) -> str:
     """Creates a textual summary of a pandas DataFrame."""
     summary = f"Summary for {filename}:\n"
-    buffer = io.StringIO()
-    df.info(buf=buffer)
-    summary += "Schema/Info:\n" + buffer.getvalue() + "\n"
+    # Shape + dtypes directly; df.info() walks every column again just to count non-nulls
+    summary += f"Schema/Info:\n{df.shape[0]} rows x {df.shape[1]} columns\n" + df.dtypes.to_string() + "\n"
     summary += "First 5 Rows:\n" + df.head().to_string() + "\n"
     # Could add more: df.describe().to_string() for numerical stats
     return summary
 
+def _read_csv(file_path: str) -> pd.DataFrame:
+    if PYARROW_AVAILABLE:
+        try: return pd.read_csv(file_path, engine='pyarrow')
+        except Exception as e: print(f"[Parser] PyArrow CSV read failed ({e}), retrying with pandas engine.")
+    return pd.read_csv(file_path)
+
+def _read_json_lines(file_path: str) -> pd.DataFrame:
+    if PYARROW_AVAILABLE:
+        try: return pa_json.read_json(file_path).to_pandas()
+        except Exception: pass # Not newline-delimited (or nested beyond Arrow's inference); let pandas decide
+    return pd.read_json(file_path, orient='records', lines=True)
+
 async def _parse_structured(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str], Optional[pd.DataFrame]]:
     """Parses CSV, XLSX, JSON into DataFrame and generates summary."""
     chunks = []; urls = set(); df = None
     file_extension = os.path.splitext(original_name)[1].lower()
     print(f"[Parser] Processing Structured Data ({file_extension}): {original_name}")
     try:
+        loop = asyncio.get_running_loop() # Reads are blocking; keep them off the event loop
         if file_extension == '.csv':
-            df = pd.read_csv(file_path)
+            df = await loop.run_in_executor(None, _read_csv, file_path)
         elif file_extension == '.xlsx':
-            df = pd.read_excel(file_path)
+            df = await loop.run_in_executor(None, pd.read_excel, file_path)
         elif file_extension == '.json':
             # Try loading common JSON structures (list of records or single object)
-            try: df = pd.read_json(file_path, orient='records', lines=True) # Try lines first
-            except ValueError: df = pd.read_json(file_path, orient='records') # Try standard records array
+            try: df = await loop.run_in_executor(None, _read_json_lines, file_path) # Try lines first
+            except ValueError: df = await loop.run_in_executor(None, lambda: pd.read_json(file_path, orient='records')) # Try standard records array
             except Exception: # Fallback for complex/nested JSON
                  with open(file_path, 'r') as f: raw_json_text = f.read()
                  # Just chunk the raw JSON text if pandas fails
-                 split_chunks = chunk_text(raw_json_text); df=None
+                 split_chunks = await _run_cpu_bound(chunk_text, raw_json_text); df=None
                  for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": "json_raw"}))
                  print("[Parser] Parsed JSON as raw text.")
                  return chunks, list(urls), df # Return early if raw parse
 
         if df is not None:
             summary_text = generate_df_summary(df, original_name)
-            urls.update(extract_urls(summary_text)) # Unlikely but check summary
-            split_chunks = chunk_text(summary_text) # Chunk the summary
+            split_chunks, text_urls = await _run_cpu_bound(split_and_extract, summary_text) # Chunk the summary
+            urls.update(text_urls) # Unlikely but check summary
             for text_chunk in split_chunks: chunks.append(DocumentChunk(session_id=session_id, source=original_name, text=text_chunk, metadata={"parser": f"structured_{file_extension}", "is_summary": True}))
             print(f"[Parser] Generated {len(split_chunks)} summary chunks for {original_name}.")
 
@@ -172,6 +354,68 @@ async def _parse_structured(file_path: str, original_name: str, session_id: str)
     return chunks, list(urls), df
 
 
+# --- Parsed-Output Cache ---
+# Re-uploads of identical content skip parsing/OCR entirely. Keyed by content hash + extension (parser choice) + the
+# settings that shape the output, so a config change never serves stale chunks. Bounded by PARSE_CACHE_TTL_HOURS and
+# PARSE_CACHE_MAX_MB; all of it is blocking file I/O, run in the default executor by process_document.
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''): digest.update(block)
+    return digest.hexdigest()
+
+def _parse_settings_fingerprint() -> str:
+    parse_settings = (settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, settings.TESSERACT_CONFIG, settings.OCR_DPI, settings.OCR_RETRY_DPI,
+                      settings.OCR_RETRY_MIN_CHARS, settings.OCR_PREPROCESS, settings.OCR_ADAPTIVE_THRESHOLD, settings.OCR_ADAPTIVE_MIN_PIXELS)
+    return hashlib.sha256(repr(parse_settings).encode("utf-8")).hexdigest()[:16]
+
+def _parse_cache_key(file_path: str, file_extension: str) -> str:
+    return f"{_file_sha256(file_path)}_{_parse_settings_fingerprint()}{file_extension}"
+
+def _parse_cache_path(cache_key: str) -> str:
+    return os.path.join(settings.PARSE_CACHE_DIR, f"{cache_key}.pkl")
+
+def _load_cached_parse(cache_key: str, original_name: str, session_id: str) -> Optional[Tuple[List[DocumentChunk], List[str], Optional[pd.DataFrame]]]:
+    """Returns cached (chunks, urls, dataframe) rebound to this session/filename, or None on a miss."""
+    cache_path = _parse_cache_path(cache_key)
+    try: age = time.time() - os.path.getmtime(cache_path)
+    except OSError: return None
+    if age > settings.PARSE_CACHE_TTL_HOURS * 3600: return None # Expired; pruned on the next store
+    try:
+        with open(cache_path, 'rb') as f: chunks, urls, dataframe = pickle.load(f)
+        os.utime(cache_path) # Recently used entries are the last to be evicted
+    except Exception as e:
+        print(f"[Parser Service] WARNING: Ignoring unreadable parse cache entry {cache_path}: {e}")
+        return None
+    # Cached chunks belong to the session that first parsed the file; give them fresh identity for this one
+    chunks = [chunk.model_copy(update={"session_id": session_id, "source": original_name, "chunk_id": str(uuid.uuid4())}) for chunk in chunks]
+    return chunks, urls, dataframe
+
+def _prune_parse_cache():
+    """Drops expired entries, then the least recently used ones until the cache fits in PARSE_CACHE_MAX_MB."""
+    entries = []
+    for entry in os.scandir(settings.PARSE_CACHE_DIR):
+        try: stat = entry.stat()
+        except OSError: continue
+        if entry.name.endswith(".pkl"): entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort() # Oldest first
+    now = time.time(); max_bytes = settings.PARSE_CACHE_MAX_MB * 1024 * 1024; total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if total <= max_bytes and now - mtime <= settings.PARSE_CACHE_TTL_HOURS * 3600: break
+        try: os.remove(path); total -= size
+        except OSError: pass # Already removed by a concurrent prune
+
+def _store_cached_parse(cache_key: str, result: Tuple[List[DocumentChunk], List[str], Optional[pd.DataFrame]]):
+    cache_path = _parse_cache_path(cache_key)
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f: pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path) # Atomic: concurrent readers never see a partial file
+        _prune_parse_cache()
+    except Exception as e:
+        print(f"[Parser Service] WARNING: Failed to write parse cache entry {cache_path}: {e}")
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
 # --- Main Processing Function ---
 # Add DataFrame storage to return value
 async def process_document(file_path: str, original_name: str, session_id: str) -> Tuple[List[DocumentChunk], List[str], Optional[pd.DataFrame]]:
@@ -179,10 +423,19 @@ async def process_document(file_path: str, original_name: str, session_id: str)
     Routes file processing based on extension.
     Returns chunks, unique URLs, and DataFrame (for structured types).
     """
-    import traceback # Ensure traceback is imported here too
     print(f"[Parser Service] Routing: {original_name} (Session: {session_id})")
     file_extension = os.path.splitext(original_name)[1].lower()
-    chunks = []; urls = []; dataframe = None
+    chunks = []; urls = []; unique_urls = []; dataframe = None
+
+    cache_key = None; loop = asyncio.get_running_loop()
+    try:
+        if settings.PARSE_CACHE_MAX_MB > 0:
+            cache_key = await loop.run_in_executor(None, _parse_cache_key, file_path, file_extension)
+            cached = await loop.run_in_executor(None, _load_cached_parse, cache_key, original_name, session_id)
+            if cached:
+                print(f"[Parser Service] Parse cache hit for {original_name} ({len(cached[0])} chunks).")
+                return cached
+    except Exception as e: print(f"[Parser Service] WARNING: Parse cache lookup failed for {original_name}: {e}")
 
     try:
         if file_extension == '.pdf':
@@ -202,6 +455,8 @@ async def process_document(file_path: str, original_name: str, session_id: str)
 
         unique_urls = sorted(list(set(urls))) # Ensure unique URLs
         print(f"[Parser Service] Finished processing {original_name}. Found {len(chunks)} chunks, {len(unique_urls)} unique URLs. DataFrame generated: {dataframe is not None}")
+        if cache_key and (chunks or dataframe is not None): # Don't cache failed/empty parses
+            await loop.run_in_executor(None, _store_cached_parse, cache_key, (chunks, unique_urls, dataframe if file_extension in ['.csv', '.xlsx', '.json'] else None))
 
     except Exception as e:
          print(f"[Parser Service] CRITICAL ERROR during processing of {original_name}: {e}")
@@ -2,7 +2,14 @@ from PIL import Image
 import pytesseract
 from app.core.config import settings
 import os
-from typing import Union
+import re
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, Iterator, Any, List
 import numpy as np
 
 # Try importing OpenCV, handle gracefully if not installed
@@ -19,26 +26,100 @@ except ImportError:
     OPENCV_AVAILABLE = False
     cv2 = None # Define cv2 as None to avoid NameErrors later
 
+# Try importing tesserocr (in-process Tesseract API); pytesseract (one subprocess per image) is the fallback
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+    print("[OCR Service] tesserocr library found.")
+except ImportError:
+    tesserocr = None
+    TESSEROCR_AVAILABLE = False
+
+# Decode target (px per side) for JPEG inputs; enough for body text, far below modern phone-camera resolution
+OCR_JPEG_DRAFT_SIZE = 2000
+
+# --- OCR Result Cache ---
+# Identical images (same page re-uploaded, repeated scans) skip Tesseract. Small LRU keyed by preprocessed pixels.
+OCR_CACHE_MAX_ENTRIES = 256
+_ocr_cache: "OrderedDict[str, str]" = OrderedDict()
+_ocr_cache_lock = threading.Lock() # OCR runs on concurrent executor threads; move_to_end/popitem would otherwise race
+
+# Page-level parallelism (worker processes/threads) beats Tesseract's internal OpenMP threads, which otherwise
+# oversubscribe the cores; must be set before any tesseract process or tesserocr engine starts
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 # Set Tesseract command if configured
 if settings.TESSERACT_CMD and os.path.exists(settings.TESSERACT_CMD):
      pytesseract.pytesseract.tesseract_cmd = settings.TESSERACT_CMD
 
+def _probe_tesseract_binary() -> bool:
+    try: pytesseract.get_tesseract_version(); return True
+    except Exception: return False
+
+# Checked once at import: without an engine every OCR call would spawn a doomed subprocess only to fail
+TESSERACT_BINARY_AVAILABLE = _probe_tesseract_binary()
+OCR_AVAILABLE = TESSERACT_BINARY_AVAILABLE or TESSEROCR_AVAILABLE # tesserocr links libtesseract, no binary needed
+if not OCR_AVAILABLE: print("WARNING: Tesseract not found (no binary, no tesserocr). OCR will be skipped.")
+
+def warm_up_tesseract():
+    """Runs one tiny OCR so the first real request doesn't pay for loading tessdata from cold disk."""
+    if not TESSERACT_BINARY_AVAILABLE: return
+    try:
+        version = pytesseract.get_tesseract_version()
+        pytesseract.image_to_string(Image.new("L", (32, 32), color=255), lang='eng', config=settings.TESSERACT_CONFIG)
+        print(f"[OCR Service] Tesseract {version} warmed up.")
+    except pytesseract.TesseractNotFoundError:
+        print("WARNING: Tesseract executable not found. OCR will fail.")
+    except Exception as e:
+        print(f"WARNING: Tesseract warm-up failed: {e}")
+
+def _config_mode(flag: str, default: int) -> int:
+    """Reads --oem/--psm from TESSERACT_CONFIG so tesserocr and pytesseract run with the same modes."""
+    match = re.search(rf"--{flag}\s+(\d+)", settings.TESSERACT_CONFIG)
+    return int(match.group(1)) if match else default
+
+_engine_local = threading.local()
+
+def _thread_engine() -> Optional[Any]:
+    """This thread's tesserocr engine, created on first use and kept for the thread's lifetime (the LSTM model loads
+    once, not per image). One per thread because PyTessBaseAPI isn't thread-safe. None means use pytesseract."""
+    if not TESSEROCR_AVAILABLE or getattr(_engine_local, "failed", False): return None
+    engine = getattr(_engine_local, "engine", None)
+    if engine is None:
+        try: engine = _engine_local.engine = tesserocr.PyTessBaseAPI(lang='eng', psm=_config_mode("psm", 3), oem=_config_mode("oem", 3))
+        except Exception as e:
+            print(f"WARNING: tesserocr init failed ({e}); falling back to pytesseract.")
+            _engine_local.failed = True
+    return engine
+
+@contextmanager
+def tesseract_engine() -> Iterator[Optional[Any]]:
+    """Engine to pass to a batch of perform_ocr(..., engine=...) calls made from this thread.
+    Yields None when tesserocr isn't installed (or fails to start); perform_ocr then uses pytesseract."""
+    yield _thread_engine()
+
 def preprocess_image_for_ocr(image: np.ndarray) -> np.ndarray:
-    """Applies preprocessing steps to an image loaded with OpenCV."""
+    """Applies preprocessing steps to a grayscale (or BGR) uint8 image; returns a single-channel binary image."""
     if not OPENCV_AVAILABLE:
         print("[OCR Preprocessing] Skipping: OpenCV not available.")
         return image # Return original if OpenCV cannot be used
 
     print("[OCR Preprocessing] Applying steps...")
-    # 1. Convert to Grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    print("[OCR Preprocessing] Converted to grayscale.")
+    # 1. Convert to Grayscale (callers normally pass grayscale already, saving a full color pass)
+    if image.ndim == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        print("[OCR Preprocessing] Converted to grayscale.")
+    else: gray = image
 
     # 2. Apply Thresholding (Otsu's binarization works well often)
-    #    Alternatively, use adaptive thresholding for varying light:
-    #    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-    thresh_val, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    print(f"[OCR Preprocessing] Applied Otsu thresholding (Value: {thresh_val}).")
+    #    Non-inverted: Tesseract expects dark text on a light background
+    if settings.OCR_ADAPTIVE_THRESHOLD and gray.shape[0] * gray.shape[1] > settings.OCR_ADAPTIVE_MIN_PIXELS:
+        # Large scans: a sliding-window threshold copes with uneven illumination that a single global value can't
+        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+        print(f"[OCR Preprocessing] Applied adaptive thresholding ({gray.shape[1]}x{gray.shape[0]}).")
+    else:
+        thresh_val, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        print(f"[OCR Preprocessing] Applied Otsu thresholding (Value: {thresh_val}).")
 
     # 3. Optional: Noise Reduction (Median Blur)
     #    Can sometimes help, but might blur small details in handwriting
@@ -66,8 +147,126 @@ def preprocess_image_for_ocr(image: np.ndarray) -> np.ndarray:
     return processed
 
 
-def perform_ocr(image_input: Union[str, Image.Image]) -> str:
-    """Performs OCR, applying preprocessing if OpenCV is available."""
+def _preprocess_pil(pil_image: Image.Image) -> Union[Image.Image, np.ndarray]:
+    """Grayscale + threshold via preprocess_image_for_ocr; returns the original image if OpenCV is missing or fails."""
+    if not OPENCV_AVAILABLE or not settings.OCR_PREPROCESS: return pil_image
+    try:
+        # Let PIL produce the single-channel image directly: no RGB->BGR reorder or extra copy
+        gray_image = np.asarray(pil_image.convert("L"))
+        # Apply preprocessing functions; pytesseract accepts the resulting ndarray as-is
+        processed = preprocess_image_for_ocr(gray_image)
+        print("[OCR Service] Preprocessing applied.")
+        return processed
+    except Exception as preproc_err:
+        print(f"WARNING: Preprocessing failed: {preproc_err}. Using original image for OCR.")
+        return pil_image # Fallback
+
+def _cache_get(cache_key: str) -> Optional[str]:
+    with _ocr_cache_lock:
+        cached_text = _ocr_cache.get(cache_key)
+        if cached_text is not None: _ocr_cache.move_to_end(cache_key)
+    if cached_text is not None: print("[OCR Service] OCR cache hit.")
+    return cached_text
+
+def _cache_put(cache_key: str, text: str):
+    with _ocr_cache_lock:
+        _ocr_cache[cache_key] = text
+        if len(_ocr_cache) > OCR_CACHE_MAX_ENTRIES: _ocr_cache.popitem(last=False)
+
+def _ocr_preprocessed(processed: Union[Image.Image, np.ndarray], engine: Optional[Any] = None) -> str:
+    """OCRs an already-preprocessed image, going through the result cache."""
+    cache_key = hashlib.sha256(processed.tobytes()).hexdigest()
+    cached_text = _cache_get(cache_key)
+    if cached_text is not None: return cached_text
+
+    print("[OCR Service] Performing Tesseract OCR...")
+    if engine is not None:
+        engine.SetImage(processed if isinstance(processed, Image.Image) else Image.fromarray(processed))
+        text = engine.GetUTF8Text()
+    else:
+        text = pytesseract.image_to_string(processed, lang='eng', config=settings.TESSERACT_CONFIG) # Pass preprocessed image
+    print("[OCR Service] OCR complete.")
+    text = text.strip()
+    _cache_put(cache_key, text)
+    return text
+
+def _ocr_file(image_path: str, engine: Optional[Any] = None) -> str:
+    """OCRs an image file as-is (no preprocessing), cached by file content."""
+    with open(image_path, 'rb') as f: cache_key = "file:" + hashlib.sha256(f.read()).hexdigest()
+    cached_text = _cache_get(cache_key)
+    if cached_text is not None: return cached_text
+
+    print("[OCR Service] Performing Tesseract OCR on file...")
+    if engine is not None:
+        engine.SetImageFile(image_path)
+        text = engine.GetUTF8Text()
+    else:
+        text = pytesseract.image_to_string(image_path, lang='eng', config=settings.TESSERACT_CONFIG)
+    print("[OCR Service] OCR complete.")
+    text = text.strip()
+    _cache_put(cache_key, text)
+    return text
+
+def _tesseract_file_list(images: List[Union[Image.Image, np.ndarray]]) -> List[str]:
+    """Runs one tesseract process over all images via a list file (tesseract's batch mode); pages come back \\f-separated."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = []
+        for n, image in enumerate(images):
+            image_path = os.path.join(tmp_dir, f"{n}.png")
+            (image if isinstance(image, Image.Image) else Image.fromarray(image)).save(image_path)
+            image_paths.append(image_path)
+        list_path = os.path.join(tmp_dir, "images.txt")
+        with open(list_path, "w") as f: f.write("\n".join(image_paths) + "\n")
+        output = pytesseract.image_to_string(list_path, lang='eng', config=settings.TESSERACT_CONFIG)
+    pages = output.split("\f")
+    if len(pages) < len(images): raise ValueError(f"expected {len(images)} pages, tesseract returned {len(pages)}")
+    return [page.strip() for page in pages[:len(images)]]
+
+def perform_ocr_batch(images: List[Image.Image]) -> List[str]:
+    """OCRs several images with a single Tesseract start-up, returning texts in input order: a shared tesserocr
+    engine if installed, otherwise one tesseract run over a list file instead of one pytesseract process per image."""
+    if not OCR_AVAILABLE: return [""] * len(images)
+    with tesseract_engine() as engine:
+        if engine is not None or len(images) < 2:
+            return [perform_ocr(image, engine=engine) for image in images]
+
+    texts: List[str] = [""] * len(images)
+    pending = [] # (index, cache_key, preprocessed image) for cache misses
+    for i, image in enumerate(images):
+        try:
+            processed = _preprocess_pil(image)
+            cache_key = hashlib.sha256(processed.tobytes()).hexdigest()
+            cached_text = _cache_get(cache_key)
+            if cached_text is not None: texts[i] = cached_text
+            else: pending.append((i, cache_key, processed))
+        except Exception as e: print(f"ERROR: OCR failed for batch image {i+1}: {e}")
+    if not pending: return texts
+
+    print(f"[OCR Service] Performing batched Tesseract OCR on {len(pending)} image(s)...")
+    try:
+        batch_texts = _tesseract_file_list([processed for _, _, processed in pending])
+    except pytesseract.TesseractNotFoundError:
+        print("ERROR: Tesseract executable not found. OCR failed.")
+        return texts
+    except Exception as e:
+        print(f"WARNING: Batched Tesseract run failed ({e}); OCRing images individually.")
+        def _ocr_pending(item) -> str:
+            i, _, processed = item
+            try: return _ocr_preprocessed(processed)
+            except Exception as page_err: print(f"ERROR: OCR failed for batch image {i+1}: {page_err}"); return ""
+        # pytesseract waits on a tesseract subprocess (GIL released), so threads are enough to use every core
+        with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+            for (i, _, _), text in zip(pending, executor.map(_ocr_pending, pending)): texts[i] = text
+        return texts
+    for (i, cache_key, _), text in zip(pending, batch_texts):
+        texts[i] = text; _cache_put(cache_key, text)
+    print("[OCR Service] Batched OCR complete.")
+    return texts
+
+def perform_ocr(image_input: Union[str, Image.Image], engine: Optional[Any] = None) -> str:
+    """Performs OCR, applying preprocessing if OpenCV is available.
+    Uses this thread's persistent tesserocr engine when available, else a pytesseract subprocess."""
+    if not OCR_AVAILABLE: return ""
     pil_image = None
     image_source = "Unknown"
 
@@ -79,8 +278,16 @@ def perform_ocr(image_input: Union[str, Image.Image]) -> str:
              if not os.path.exists(image_source):
                   print(f"ERROR: Image file not found: {image_source}")
                   return ""
+             if not (OPENCV_AVAILABLE and settings.OCR_PREPROCESS):
+                 # Nothing to do to the pixels: let Tesseract read the file itself instead of PIL decoding it
+                 # and pytesseract re-encoding it to a temp file
+                 return _ocr_file(image_source, engine if engine is not None else _thread_engine())
              # Load with PIL first to ensure compatibility
              pil_image = Image.open(image_source)
+             if pil_image.format == "JPEG":
+                 # libjpeg decodes straight to grayscale at a reduced scale (1/2, 1/4, 1/8) that still covers the
+                 # target size, so phone photos never materialize their full-resolution RGB buffer
+                 pil_image.draft("L", (OCR_JPEG_DRAFT_SIZE, OCR_JPEG_DRAFT_SIZE))
         elif isinstance(image_input, Image.Image): # Input is a PIL Image object
              image_source = "PIL Image object"
              print(f"[OCR Service] Using provided {image_source}")
@@ -90,27 +297,9 @@ def perform_ocr(image_input: Union[str, Image.Image]) -> str:
              return ""
 
         # --- Preprocessing ---
-        processed_image_for_tesseract = pil_image # Default to original PIL image
-        if OPENCV_AVAILABLE and pil_image:
-             try:
-                 # Convert PIL Image to OpenCV format (NumPy array)
-                 open_cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-                 # Apply preprocessing functions
-                 processed_open_cv_image = preprocess_image_for_ocr(open_cv_image)
-                 # Convert preprocessed OpenCV image back to PIL format for Pytesseract
-                 processed_image_for_tesseract = Image.fromarray(cv2.cvtColor(processed_open_cv_image, cv2.COLOR_BGR2RGB))
-                 print("[OCR Service] Preprocessing applied.")
-             except Exception as preproc_err:
-                  print(f"WARNING: Preprocessing failed: {preproc_err}. Using original image for OCR.")
-                  processed_image_for_tesseract = pil_image # Fallback
-
-        # --- Perform OCR ---
-        print("[OCR Service] Performing Tesseract OCR...")
-        # Use specific language if known, add config options if needed
-        # e.g., custom_config = r'--oem 3 --psm 6'
-        text = pytesseract.image_to_string(processed_image_for_tesseract, lang='eng') # Pass preprocessed image
-        print("[OCR Service] OCR complete.")
-        return text.strip()
+        processed_image_for_tesseract = _preprocess_pil(pil_image)
+        # --- Cache Lookup / Perform OCR ---
+        return _ocr_preprocessed(processed_image_for_tesseract, engine if engine is not None else _thread_engine())
 
     except ImportError as imp_err:
         # Catch potential Pillow/Numpy import errors if environment is broken
@@ -1,15 +1,61 @@
 import re
-from typing import List
-from nltk.tokenize import sent_tokenize
+from collections import deque
+from functools import lru_cache
+from typing import Deque, List, Tuple
 import nltk
+import numpy as np
 from app.core.config import settings
 
-# Download 'punkt' sentence tokenizer model if not already downloaded
+# BlingFire's C++ sentence breaker is ~20x faster than Punkt; NLTK is the fallback
 try:
-    nltk.data.find('tokenizers/punkt')
-except nltk.downloader.DownloadError:
-    print("NLTK 'punkt' model not found. Downloading...")
-    nltk.download('punkt')
+    import blingfire
+    BLINGFIRE_AVAILABLE = True
+except ImportError:
+    blingfire = None
+    BLINGFIRE_AVAILABLE = False
+
+@lru_cache(maxsize=8)
+def _sentence_tokenizer(language: str = "english"):
+    """Loads the Punkt model once per language; sent_tokenize() can rebuild it on every call."""
+    try:
+        from nltk.tokenize import PunktTokenizer # NLTK >= 3.8.2 (punkt_tab resource)
+        return PunktTokenizer(language)
+    except (ImportError, LookupError):
+        return nltk.data.load(f'tokenizers/punkt/{language}.pickle') # Older NLTK / pickled model
+
+# Punkt is installed ahead of time (see README: python -m nltk.downloader punkt punkt_tab), never fetched here:
+# a download at import put a network round-trip in front of the first request. Load it now so that request
+# doesn't pay for it either; without BlingFire there is no other sentence splitter, so fail fast.
+if not BLINGFIRE_AVAILABLE:
+    try: _sentence_tokenizer()
+    except LookupError as e: raise RuntimeError("NLTK 'punkt' model not found. Run: python -m nltk.downloader punkt punkt_tab") from e
+
+def split_sentences(text: str) -> List[str]:
+    if BLINGFIRE_AVAILABLE:
+        # One sentence per line in the output (internal newlines are folded to spaces)
+        return [sentence for sentence in blingfire.text_to_sentences(text).split("\n") if sentence]
+    return _sentence_tokenizer().tokenize(text)
+
+def _split_long_sentence(sentence: str, chunk_size: int) -> List[str]:
+    """Splits a single sentence longer than chunk_size (basic split by space near chunk_size)."""
+    parts = []
+    sentence_length = len(sentence)
+    # All space positions up front (UTF-32 gives one uint32 per code point, so indices match str indices);
+    # each break point is then a binary search instead of an rfind scan back over the window
+    spaces = np.flatnonzero(np.frombuffer(sentence.encode('utf-32-le'), dtype=np.uint32) == 0x20)
+    start = 0
+    while start < sentence_length:
+        end = min(start + chunk_size, sentence_length)
+        # Try to find a space to break near the end point (last space in [start, end))
+        space_idx = np.searchsorted(spaces, end) - 1
+        split_pos = int(spaces[space_idx]) if space_idx >= 0 and spaces[space_idx] >= start else -1
+        if split_pos != -1 and end < sentence_length: # Found a space before the end
+            parts.append(sentence[start:split_pos].strip())
+            start = split_pos + 1
+        else: # No space or at the very end
+            parts.append(sentence[start:end].strip())
+            start = end
+    return [p for p in parts if p] # Non-empty parts
 
 def chunk_text(text: str, chunk_size: int = settings.CHUNK_SIZE, chunk_overlap: int = settings.CHUNK_OVERLAP) -> List[str]:
     """
@@ -20,68 +66,59 @@ def chunk_text(text: str, chunk_size: int = settings.CHUNK_SIZE, chunk_overlap:
     if chunk_overlap >= chunk_size:
         chunk_overlap = int(chunk_size / 4) # Sensible default overlap
 
-    sentences = sent_tokenize(text)
+    # Drop blank sentences up front so no chunk can end up empty (no strip() filter pass over the output)
+    sentences = [sentence for sentence in split_sentences(text) if sentence and not sentence.isspace()]
+    sentence_lengths = [len(sentence) for sentence in sentences]
     chunks = []
-    current_chunk_sentences = []
-    current_length = 0
-
-    for sentence in sentences:
-        sentence_length = len(sentence)
-        if current_length + sentence_length <= chunk_size:
-            current_chunk_sentences.append(sentence)
-            current_length += sentence_length
-        else:
-            # Finalize the current chunk
-            if current_chunk_sentences:
-                 chunks.append(" ".join(current_chunk_sentences))
-
-            # Start new chunk, considering overlap
-            # Find sentences from the end of the previous chunk to form the overlap
-            overlap_sentences = []
-            overlap_len = 0
-            for s in reversed(current_chunk_sentences):
-                s_len = len(s)
-                if overlap_len + s_len <= chunk_overlap:
-                    overlap_sentences.insert(0, s) # Add to beginning
-                    overlap_len += s_len
-                else:
-                    break # Overlap is full enough
-
-            # Start the new chunk with overlap (if any) and the current sentence
-            current_chunk_sentences = overlap_sentences + [sentence]
-            current_length = overlap_len + sentence_length
-
-            # Handle cases where a single sentence is longer than chunk_size
-            if not overlap_sentences and sentence_length > chunk_size:
-                 # Split the long sentence itself (basic split by space near chunk_size)
-                 parts = []
-                 start = 0
-                 while start < sentence_length:
-                    end = min(start + chunk_size, sentence_length)
-                    # Try to find a space to break near the end point
-                    split_pos = sentence.rfind(' ', start, end)
-                    if split_pos != -1 and end < sentence_length: # Found a space before the end
-                        parts.append(sentence[start:split_pos].strip())
-                        start = split_pos + 1
-                    else: # No space or at the very end
-                        parts.append(sentence[start:end].strip())
-                        start = end
-                 chunks.extend([p for p in parts if p]) # Add non-empty parts
-                 current_chunk_sentences = [] # Reset as the long sentence was fully processed
-                 current_length = 0
+    # Sliding window over sentences: append at the right, drop from the left. Lengths exclude the joining spaces.
+    window: Deque[str] = deque()
+    window_length = 0
+
+    for sentence, sentence_length in zip(sentences, sentence_lengths):
+        if window_length + sentence_length <= chunk_size:
+            window.append(sentence)
+            window_length += sentence_length
+            continue
 
+        # Finalize the current chunk
+        if window:
+            chunks.append(" ".join(window))
+
+        # What's left after trimming from the front is the longest tail that fits in chunk_overlap,
+        # i.e. the overlap the next chunk starts with
+        while window and window_length > chunk_overlap:
+            window_length -= len(window.popleft())
+
+        # Handle cases where a single sentence is longer than chunk_size (and there's no overlap to carry)
+        if not window and sentence_length > chunk_size:
+            chunks.extend(_split_long_sentence(sentence, chunk_size))
+            continue # Long sentence fully processed; next chunk starts empty
+
+        window.append(sentence)
+        window_length += sentence_length
 
     # Add the last chunk if it has content
-    if current_chunk_sentences:
-        chunks.append(" ".join(current_chunk_sentences))
+    if window:
+        chunks.append(" ".join(window))
 
-    # Filter out any potentially empty chunks
-    return [chunk for chunk in chunks if chunk.strip()]
+    return chunks
 
 # --- Add URL Extraction ---
 URL_REGEX = r'https?://[^\s<>"]+|www\.[^\s<>"]+'
+# Compiled once at import. google-re2 (linear-time DFA, no backtracking) when installed, else stdlib re
+try:
+    import re2
+    _URL_PATTERN = re2.compile(URL_REGEX)
+except ImportError:
+    _URL_PATTERN = re.compile(URL_REGEX)
 
 def extract_urls(text: str) -> List[str]:
     """Finds potential URLs in a block of text."""
-    return re.findall(URL_REGEX, text)
+    # Most text has no URLs at all; plain substring checks (memchr-speed) skip the regex scan entirely
+    if "://" not in text and "www." not in text: return []
+    return _URL_PATTERN.findall(text)
+
+def split_and_extract(text: str) -> Tuple[List[str], List[str]]:
+    """chunk_text + extract_urls for one block of text: returns (chunks, urls)."""
+    return chunk_text(text), extract_urls(text)
 
@@ -1,15 +1,25 @@
 # backend/main.py
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Any # Keep Dict, Any
 
 # Import state store
 from app.core import state as app_state # Import the new state module
 from app.core.config import settings
+
+# Configure logging once, before the service modules (which log at import time) are loaded
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 from app.api.endpoints import upload, query # Import endpoint routers
 from app.api.endpoints import status as status_endpoint # Added status endpoint
+from app.services.parser.ocr import warm_up_tesseract
 
 # --- Lifespan Function ---
 @asynccontextmanager
@@ -24,16 +34,31 @@ async def lifespan(app: FastAPI):
     app_state.session_status_store.clear() # Ensure store is empty on startup
 
     if not settings.TAVILY_API_KEY: print("WARNING: TAVILY_API_KEY not set. Web search will be disabled.")
+    warm_up_tesseract()
+    # Workers must not fork from this process: it already runs torch/OpenMP threads and the event loop, and a fork of a
+    # multithreaded process can deadlock. forkserver (spawn where unavailable) starts them clean; their jobs only need the parser modules
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    app_state.cpu_pool = ProcessPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, settings.PARSE_POOL_WORKERS)), mp_context=multiprocessing.get_context(start_method))
     print("[Lifespan] Backend setup complete.")
     yield # API ready
 
     # --- Shutdown ---
     print("Shutting down backend server...")
+    app_state.cpu_pool.shutdown(cancel_futures=True); app_state.cpu_pool = None
+
+# --- Response Serialization ---
+# orjson serializes large answer/table payloads several times faster than stdlib json; fall back if not installed
+try:
+    import orjson # noqa: F401 (ORJSONResponse needs it at render time)
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    DefaultResponse = JSONResponse
 
 # --- FastAPI App Instance ---
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=DefaultResponse,
     lifespan=lifespan
 )
 
@@ -62,4 +87,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
+
+# --- Response Compression ---
+# JSON answers with tables/sources shrink several-fold; bodies under 1 KB aren't worth the CPU.
+# requests (the Streamlit client) sends Accept-Encoding: gzip by default, so the frontend needs no change.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
\ No newline at end of file
@@ -2,76 +2,312 @@
 
 import streamlit as st
 import requests
-import pandas as pd
-import plotly.graph_objects as go
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
 import time
-import traceback # For better error logging in frontend
-import re # For URL checking
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+import hashlib
+import gzip
+import socket
+from urllib.parse import quote
+
+# Optional: streams multipart bodies straight from the uploaded file buffers instead of building the body in memory
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+except ImportError:
+    MultipartEncoder = None
+
+# Optional: faster JSON decoding/encoding of backend responses and request bodies (stdlib json used if absent)
+try:
+    import orjson
+    _json_loads = orjson.loads; _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads; _json_dumps = lambda obj: json.dumps(obj).encode("utf-8")
+
+# --- Logging ---
+# %-style args: messages (and reprs of response dicts) are only formatted when the level is enabled
+logger = logging.getLogger("frontend")
+if not logger.handlers:
+    _handler = logging.StreamHandler(); _handler.setFormatter(logging.Formatter("Frontend: %(levelname)s %(message)s"))
+    logger.addHandler(_handler); logger.propagate = False
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 # --- Configuration ---
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
 UPLOAD_ENDPOINT = f"{BACKEND_URL}/api/v1/upload"
 ASK_ENDPOINT = f"{BACKEND_URL}/api/v1/ask"
 STATUS_ENDPOINT = f"{BACKEND_URL}/api/v1/status"
+PARALLEL_UPLOADS = 4 # Concurrent single-file upload requests when several files are selected
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024 # Files above this go up as 8 MB PATCH chunks (stays under proxy body limits, resumable)
+UPLOAD_GZIP_MIN_BYTES = 4 * 1024 # Smaller text files aren't worth the gzip round trip
+GZIP_UPLOAD_TYPES = ("text/", "application/json", "application/xml") # PDF/DOCX/XLSX/images are already compressed; sent as-is
+HISTORY_WINDOW = 30 # Chat messages kept in `messages` and rendered per run; older ones are archived behind a toggle
+MAX_ARCHIVED_MESSAGES = 200 # Oldest archived messages are dropped beyond this, so a session's chat memory stays bounded
+POLL_INTERVAL_MIN, POLL_INTERVAL_MAX = 0.5, 8.0 # Fallback poll backoff bounds (seconds)
+STATUS_STREAM_READ_TIMEOUT = 10 # The backend sends a keep-alive every 5 s; a status stream silent for longer is reopened
+STATUS_LONG_POLL_SECONDS = 55 # Fallback status check when the event stream is unavailable: server holds it until a change
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024)) # Per file; larger files are rejected before any upload
+MAX_TOTAL_UPLOAD_BYTES = int(os.getenv("MAX_TOTAL_UPLOAD_BYTES", 200 * 1024 * 1024)) # Warn (but still upload) above this total
+
+# st.fragment (Streamlit >= 1.37; experimental_fragment before that) scopes reruns to one function; plain call on older versions
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
 
 # --- Set Page Config FIRST ---
 st.set_page_config(page_title="Mando AI Document Q&A", layout="wide", initial_sidebar_state="expanded")
 
 # --- Custom CSS ---
-# Using a more compact way to include CSS
-st.markdown("""
-<style>
-    /* Style for user messages */
-    div[data-testid="stChatMessage"][class*="user"] { background-color: #DCF8C6; border-radius: 10px 10px 0 10px; padding: 10px; border: 1px solid #A5D6A7; margin-bottom: 10px; margin-left: auto; margin-right: 5px; float: right; clear: both; max-width: 75%;}
-    /* Style for assistant messages */
-    div[data-testid="stChatMessage"][class*="assistant"] { background-color: #FFFFFF; border-radius: 10px 10px 10px 0; padding: 10px; border: 1px solid #E0E0E0; margin-bottom: 10px; margin-left: 5px; margin-right: auto; float: left; clear: both; max-width: 75%;}
-    .stChatMessage { overflow: hidden; } /* Contain floats */
-    .stChatMessage:after { content: ""; display: table; clear: both; }
-    .stCaption { font-size: 0.85em; color: #555; }
-    .stExpander { border: none !important; margin-top: -5px; background-color: transparent !important; }
-    .stExpander header { font-size: 0.9em; color: #444; padding: 2px 0px !important; }
-    .stButton>button { width: 100%; }
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource
+def _load_css():
+    """Reads static/chat.css once per server process."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "chat.css"), encoding="utf-8") as css_file:
+        return f"<style>\n{css_file.read()}</style>"
+
+# Emitted on every run on purpose: Streamlit drops elements a rerun doesn't re-emit, so a "once" guard would lose the styles.
+# An unchanged element is diffed away on the client, so re-emitting the same string is cheap.
+st.markdown(_load_css(), unsafe_allow_html=True)
+
+# --- HTTP Session ---
+# TCP_NODELAY (urllib3's default) so small status/ask requests aren't Nagle-delayed, plus keepalive probes so the
+# long-lived status stream / pooled connections survive idle NAT and proxy timeouts. TCP_KEEPIDLE is Linux-only.
+_SOCKET_OPTIONS = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, "TCP_KEEPIDLE"): _SOCKET_OPTIONS.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30))
+
+class _TunedAdapter(HTTPAdapter):
+    """Sends request bodies in 64 KiB blocks (urllib3 2.x default is 16 KiB, http.client's 8 KiB): fewer send() calls on uploads.
+    Also applies _SOCKET_OPTIONS to every pooled connection."""
+    def init_poolmanager(self, *args, **kwargs):
+        if int(urllib3.__version__.split(".")[0]) >= 2: kwargs["blocksize"] = 64 * 1024
+        kwargs["socket_options"] = _SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive session per server process (cache_resource survives reruns), shared by all calls."""
+    session = requests.Session()
+    # Retry idempotent requests (status polls) on transient gateway errors; POSTs are never re-sent
+    adapter = _TunedAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    return session
 
 # --- Helper Functions ---
+def _json(response):
+    """Decodes a response body straight from its bytes (orjson when installed)."""
+    return _json_loads(response.content)
+
+def _json_request(payload):
+    """Request kwargs sending payload as a JSON body encoded by _json_dumps (instead of requests' stdlib json=)."""
+    return {"data": _json_dumps(payload), "headers": {"Content-Type": "application/json"}}
+
+def _err_detail(response):
+    """Backend error detail from a failed response (parsed once), falling back to the raw text."""
+    if response is None: return "(No details)"
+    try:
+        body = _json(response)
+        if isinstance(body, dict) and (body.get("detail") or body.get("message")): return body.get("detail") or body.get("message")
+    except Exception: pass
+    return response.text[:500] or "(No details)"
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _render_sources(sources_tuple):
+    """Builds the sources block as one markdown string (cached), making URLs clickable."""
+    lines = [f"**Sources ({len(sources_tuple)}):**"]
+    for source in sources_tuple:
+        # Check if the source looks like a URL
+        if isinstance(source, str) and (source.startswith("http://") or source.startswith("https://")):
+             lines.append(f"- [{source}]({source})") # Clickable link
+        else:
+             lines.append(f"- {source}") # Display non-URLs normally
+    return "\n".join(lines)
+
 def display_sources(sources):
-    """Displays the sources list, making URLs clickable."""
+    """Displays the sources list in one markdown element instead of one caption per source."""
     if sources:
         with st.expander("View Sources", expanded=False): # Start collapsed
-            st.markdown(f"**Sources ({len(sources)}):**")
-            for source in sources:
-                # Check if the source looks like a URL
-                if isinstance(source, str) and (source.startswith("http://") or source.startswith("https://")):
-                     st.caption(f"- [{source}]({source})") # Clickable link
-                else:
-                     st.caption(f"- {source}") # Display non-URLs normally
-
-def check_backend_status(session_id):
-    """Polls the backend status endpoint."""
+            st.markdown(_render_sources(tuple(sources)))
+
+@st.cache_resource
+def _terminal_statuses():
+    """session_id -> final 'ready'/'error' status reported by the backend, shared by all tabs/reruns; later checks skip the request."""
+    return {}
+
+def _remember_terminal_status(session_id, result):
+    if result.get("status") in ("ready", "error"):
+        terminal = _terminal_statuses(); terminal[session_id] = result
+        if len(terminal) > 1000: terminal.pop(next(iter(terminal))) # Oldest first (insertion order)
+
+def check_backend_status(session_id, wait=0):
+    """Polls the backend status endpoint; wait > 0 long-polls (the server holds the request until the status changes)."""
     if not session_id: return None
+    if session_id in _terminal_statuses(): return _terminal_statuses()[session_id]
     status_url = f"{STATUS_ENDPOINT}/{session_id}"
-    try:
-        print(f"Frontend: Checking status at {status_url}")
-        response = requests.get(status_url, timeout=15)
-        response.raise_for_status()
-        return response.json()
+    logger.debug("Checking status at %s", status_url)
+    try: response = get_http_session().get(status_url, params={"wait": wait} if wait else None, timeout=15 + wait)
     except requests.exceptions.Timeout:
-        print("Frontend: Status check timed out.")
+        logger.warning("Status check timed out.")
         return {"status": "timeout", "message": "Status check timed out."}
-    except requests.exceptions.RequestException as e:
-        print(f"Frontend: Status check failed: {e}")
-        status_code = e.response.status_code if hasattr(e, 'response') and e.response is not None else 503
-        if status_code == 404:
-             print("Frontend: Status check got 404, assuming still processing.")
-             return {"status": "processing", "message": "Backend status not found (might be starting)..."} # Treat 404 as processing
+    except requests.exceptions.RequestException as e: # Connection refused/reset: backend down or restarting
+        logger.warning("Status check failed: %s", e)
+        return {"status": "error", "message": f"Status check failed (Code: 503): {e}"}
+    # HTTP errors are plain status-code checks (no raise_for_status exception per failed poll)
+    if response.status_code == 404:
+        logger.info("Status check got 404, assuming still processing.")
+        return {"status": "processing", "message": "Backend status not found (might be starting)..."} # Treat 404 as processing
+    if not response.ok:
+        logger.warning("Status check failed: HTTP %s", response.status_code)
+        return {"status": "error", "message": f"Status check failed (Code: {response.status_code}): {_err_detail(response)}"}
+    result = _json(response); _remember_terminal_status(session_id, result)
+    return result
+
+def _is_read_timeout(e):
+    """True for a read timeout, whether raised opening the response or (wrapped in a ConnectionError) while iterating it."""
+    if isinstance(e, requests.exceptions.ReadTimeout): return True
+    return isinstance(e, requests.exceptions.ConnectionError) and bool(e.args) and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError)
+
+def stream_backend_status(session_id):
+    """Yields status dicts from the backend's SSE stream, one per change, until the terminal 'ready'/'error' event.
+    Each keep-alive yields None, so the caller makes an st.* call (the point where Streamlit can stop a run) every few seconds."""
+    if session_id in _terminal_statuses(): yield _terminal_statuses()[session_id]; return
+    # Finite read timeout: a stream that stops sending keep-alives raises instead of holding the script thread indefinitely
+    with get_http_session().get(f"{STATUS_ENDPOINT}/{session_id}/events", stream=True, timeout=(5, STATUS_STREAM_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        for raw in response.iter_lines(decode_unicode=True):
+            if raw.startswith(":"): yield None; continue # ': keep-alive' comment
+            if not raw.startswith("data:"): continue # Blank separators
+            event = _json_loads(raw[5:])
+            _remember_terminal_status(session_id, event)
+            yield event
+            if event.get("status") in ("ready", "error"): return
+
+def _send_chunked(http_session, sid, f, max_attempts=3):
+    """Sends one file as sequential Upload-Offset chunks; a failed chunk resumes from the server's offset."""
+    url = f"{UPLOAD_ENDPOINT}/session/{sid}/chunk/{quote(f.name, safe='')}"
+    offset = 0; attempts = 0
+    body = f.getbuffer() # memoryview over the upload's own buffer: chunks are zero-copy slices, not read() copies
+    while offset < f.size:
+        data = body[offset:offset + UPLOAD_CHUNK_BYTES]
+        try:
+            resp = http_session.patch(url, data=data, headers={"Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}, timeout=45)
+        except requests.exceptions.RequestException:
+            attempts += 1
+            if attempts >= max_attempts: raise
+            resp = None
+        if resp is not None and resp.status_code == 409: offset = int(resp.headers["Upload-Offset"]); continue # Resume where the server is
+        if resp is None: continue # Retry; a partial write shows up as a 409 with the real offset
+        resp.raise_for_status(); offset += len(data); attempts = 0
+
+def _post_ask(http_session, session_id, question):
+    """POSTs a question to /ask. Runs on an _ask_executor thread, so no st.* calls (cached functions included) in here:
+    the HTTP session is resolved by the caller, and repeats are served from the per-user answer_memo on the script thread.
+    Not st.cache_data either: that cache is process-wide, shared by every user."""
+    r = http_session.post(ASK_ENDPOINT, **_json_request({"question": question, "session_id": session_id}), timeout=180)
+    r.raise_for_status()
+    return _json(r)
+
+@st.cache_resource
+def _ask_executor():
+    """Worker threads for /ask calls, so the script thread can keep the 'Thinking' indicator moving."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def ask_in_background(session_id, question, placeholder):
+    """Runs _post_ask on a worker thread, animating the placeholder until it returns. Raises what _post_ask raised."""
+    future = _ask_executor().submit(_post_ask, get_http_session(), session_id, question)
+    tick = 0
+    while not future.done():
+        placeholder.markdown("Thinking" + "." * (tick % 4) + " ▌"); tick += 1
+        time.sleep(0.2)
+    return future.result()
+
+def ask_streaming(session_id, question, placeholder):
+    """Streams the answer from /ask/stream into the placeholder as it is generated; returns an /ask-shaped result dict."""
+    with get_http_session().post(f"{ASK_ENDPOINT}/stream", **_json_request({"question": question, "session_id": session_id}), stream=True, timeout=(10, 180)) as r:
+        r.raise_for_status()
+        if r.headers.get("Content-Type", "").startswith("application/json"): return _json(r) # Non-streaming server
+        answer = ""; final = {"type": "error", "sources": []} # A stream cut off before its final line counts as a failure
+        # NDJSON: {"delta": ...} lines as the answer is generated, then {"type", "sources"}; chunk_size=None yields lines as they arrive
+        for line in r.iter_lines(chunk_size=None):
+            if not line: continue
+            event = _json_loads(line)
+            if "delta" in event: answer += event["delta"]; placeholder.markdown(answer + " ▌")
+            else: final = event
+    return {"answer": answer, "type": final.get("type", "error"), "sources": final.get("sources", [])}
+
+def _upload_part(f):
+    """Multipart (name, body, type[, headers]) tuple for one file; text-like types go gzipped (typically 5-10x smaller)."""
+    if f.size < UPLOAD_GZIP_MIN_BYTES or not (f.type or "").startswith(GZIP_UPLOAD_TYPES): return (f.name, f, f.type)
+    return (f.name, gzip.compress(f.getbuffer(), compresslevel=5), f.type, {"Content-Encoding": "gzip"}) # Backend inflates on save
+
+def _upload_files_in_parallel(http_session, uploaded_files, result_slot):
+    """Several (or large) files: one upload session, one POST (or chunk sequence) per file on parallel connections, then start processing."""
+    r = http_session.post(f"{UPLOAD_ENDPOINT}/session", timeout=15); r.raise_for_status()
+    sid = _json(r)["session_id"]
+    def _send(f):
+        if f.size > UPLOAD_CHUNK_BYTES: return _send_chunked(http_session, sid, f)
+        resp = http_session.post(f"{UPLOAD_ENDPOINT}/session/{sid}/files", files={"file":_upload_part(f)}, timeout=45)
+        resp.raise_for_status()
+    result_slot["files_total"] = len(uploaded_files)
+    with ThreadPoolExecutor(max_workers=min(PARALLEL_UPLOADS, len(uploaded_files))) as executor:
+        futures = [executor.submit(_send, f) for f in uploaded_files]
+        for sent, future in enumerate(as_completed(futures), 1):
+            future.result(); result_slot["files_sent"] = sent # Raises on the first failed file
+    return http_session.post(f"{UPLOAD_ENDPOINT}/session/{sid}/process", timeout=45)
+
+def _do_upload(http_session, uploaded_files, result_slot):
+    """Background-thread upload. Only writes to result_slot (a plain dict); Streamlit APIs aren't usable off the script thread."""
+    try:
+        for f in uploaded_files: f.seek(0) # UploadedFile is a file-like buffer; send it as-is, no getvalue() copy
+        if len(uploaded_files) > 1 or uploaded_files[0].size > UPLOAD_CHUNK_BYTES:
+            response = _upload_files_in_parallel(http_session, uploaded_files, result_slot) # Compresses per file as it sends
         else:
-             return {"status": "error", "message": f"Status check failed (Code: {status_code}): {e}"}
+            fields = [("files", _upload_part(f)) for f in uploaded_files] # Single-request path: each file compressed once, here
+            if MultipartEncoder is not None:
+                # The monitor records progress in the slot; the script thread turns it into a progress bar on its next rerun
+                def _record_progress(monitor): result_slot["bytes_sent"] = monitor.bytes_read; result_slot["bytes_total"] = monitor.len
+                encoder = MultipartEncoderMonitor(MultipartEncoder(fields=fields), _record_progress)
+                response = http_session.post(UPLOAD_ENDPOINT, data=encoder, headers={"Content-Type": encoder.content_type}, timeout=45)
+            else:
+                response = http_session.post(UPLOAD_ENDPOINT, files=fields, timeout=45)
+        response.raise_for_status()
+        result_slot["result"] = _json(response)
+        logger.debug("Initial upload response: %s", result_slot["result"])
     except Exception as e:
-         print(f"Frontend: Unexpected error during status check: {e}")
-         return {"status": "error", "message": f"Unexpected error checking status: {e}"}
+        result_slot["error"] = e
+        logger.warning("Upload exception: %s", e)
+    result_slot["done"] = True
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _file_digest(file_key, _uploaded_file):
+    """128-bit blake2b of an upload's content, hashed once per (file_id, size); the leading _ keeps Streamlit from hashing the file arg."""
+    return hashlib.blake2b(_uploaded_file.getbuffer(), digest_size=16).hexdigest()
+
+def _apply_upload_result(upload_api_result, upload_error):
+    """Moves a finished upload's API result / error into session state."""
+    if upload_api_result:
+        sid, bs, msg = (upload_api_result.get(k) for k in ("session_id", "status", "message"))
+        if sid and bs=="processing":
+            st.session_state.session_id = sid
+            st.session_state.upload_status_message = msg or "✅ Files accepted. Processing started..."
+            st.session_state.upload_status_type = "info"
+            st.session_state.poll_active = True # *** Enable polling ***
+            st.session_state.poll_interval = POLL_INTERVAL_MIN; st.session_state.poll_last_msg = ""
+            logger.info("Upload success. Session: %s. Poll Active: True", sid)
+        else:
+            st.session_state.upload_status_message = f"❌ Upload Error: {msg or 'Backend issue'}"
+            st.session_state.upload_status_type = "error"
+            st.session_state.poll_active = False
+            st.session_state.session_id = None
+    elif upload_error:
+         er = getattr(upload_error, "response", None)
+         st.session_state.upload_status_message = f"❌ Upload Request Error: {upload_error}" + (f" ({_err_detail(er)})" if er is not None else "")
+         st.session_state.upload_status_type = "error"
+         st.session_state.poll_active = False
+         st.session_state.session_id = None
 
 # --- Streamlit App ---
 st.title("📄 AI Document Q&A System")
@@ -79,9 +315,30 @@ st.markdown("Upload documents (PDF, DOCX, PPTX, XLSX, CSV, JSON, TXT, PNG, JPG).
 
 # --- Session State Init ---
 # Initialize keys robustly if they don't exist
-default_state = {"session_id":None,"processing_complete":False,"upload_status_message":"","upload_status_type":"info","messages":[],"uploaded_file_names":[],"poll_active":False}
-for key, default_value in default_state.items():
-    if key not in st.session_state: st.session_state[key] = default_value
+default_state = {"session_id":None,"processing_complete":False,"upload_status_message":"","upload_status_type":"info","messages":[],"messages_archive":deque(maxlen=MAX_ARCHIVED_MESSAGES),"uploaded_file_names":[],"uploaded_file_sig":(),"uploaded_file_ids":(),"poll_active":False,"poll_interval":0.5,"poll_last_msg":"","upload_slot":None,"answer_memo":{}}
+for key, default_value in default_state.items(): st.session_state.setdefault(key, default_value)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _files_markdown(file_names):
+    """The uploaded-files list as one markdown string, built once per file set."""
+    return "\n".join(f"- `{name}`" for name in file_names)
+
+def _files_expander_state(pc, pa, ust):
+    """(label, expanded) of the "Uploaded Files" expander for processing_complete / poll_active / upload_status_type."""
+    expander_title = "Uploaded Files"; status_icon = ""
+    if not pc and pa: expander_title += " (Processing...)"; status_icon="⏳"
+    elif pc and ust != 'error': expander_title += " (Ready)"; status_icon="✅"
+    elif ust == 'error': expander_title += " (Error)"; status_icon="❌"
+    return f"{status_icon} {expander_title}", bool(pa or ust == 'success')
+
+@st.cache_resource
+def _expander_states():
+    """Every reachable (pc, pa, ust) combination, built once per server process; the sidebar does a single lookup."""
+    return {(pc, pa, ust): _files_expander_state(pc, pa, ust) for pc in (False, True) for pa in (False, True) for ust in ("info", "success", "warning", "error")}
+
+def _reset_app_state():
+    """Drops only the app's own keys; Streamlit's widget state (uploader, chat input) is left intact."""
+    for key in default_state: st.session_state.pop(key, None)
 
 # --- Sidebar ---
 with st.sidebar:
@@ -92,79 +349,95 @@ with st.sidebar:
         type=["pdf","docx","pptx","xlsx","csv","json","txt","png","jpg","jpeg"], # Correct keyword arg
         key="file_uploader" # Correct keyword arg
     )
-    current_file_names = sorted([f.name for f in uploaded_files or []])
+    # Streamlit's file_id is stable across reruns: names and the content signature are only recomputed when it changes
+    current_file_ids = tuple(getattr(f, "file_id", f.name) for f in uploaded_files or ())
+    current_sig = st.session_state.uploaded_file_sig
+    if current_file_ids != st.session_state.uploaded_file_ids:
+        st.session_state.uploaded_file_ids = current_file_ids
+        current_file_names = sorted([f.name for f in uploaded_files or []])
+        # Content signature: re-dropping the same files (or renamed identical ones) doesn't trigger a re-upload
+        current_sig = tuple(sorted(_file_digest((getattr(f, "file_id", f.name), f.size), f) for f in uploaded_files or []))
+        if current_sig == st.session_state.uploaded_file_sig: st.session_state.uploaded_file_names = current_file_names
 
     # --- Upload Logic ---
-    if current_file_names != st.session_state.uploaded_file_names:
-        print("Frontend: Detected file change in sidebar.")
+    if current_sig != st.session_state.uploaded_file_sig:
+        logger.debug("Detected file change in sidebar.")
         # --- Reset state logic ---
         # Clear previous session state ONLY if new files are actually selected
         if uploaded_files:
-            print(f"Frontend: New files detected ({len(uploaded_files)}). Resetting state.")
+            logger.info("New files detected (%d). Resetting state.", len(uploaded_files))
             st.session_state.session_id = None
             st.session_state.processing_complete = False
-            st.session_state.messages = [] # Clear chat
+            st.session_state.messages = []; st.session_state.messages_archive = deque(maxlen=MAX_ARCHIVED_MESSAGES); st.session_state.answer_memo = {} # Clear chat
             st.session_state.upload_status_message = "Initiating upload..."
             st.session_state.upload_status_type = "info"
             st.session_state.poll_active = False # Ensure polling starts fresh
             st.session_state.uploaded_file_names = current_file_names # Store names now
-
-            upload_api_result = None
-            upload_error = None
-            with st.spinner(f"Uploading {len(uploaded_files)} file(s)..."):
-                files_to_send=[("files",(f.name,f.getvalue(),f.type)) for f in uploaded_files]
-                try:
-                    response = requests.post(UPLOAD_ENDPOINT, files=files_to_send, timeout=45)
-                    response.raise_for_status()
-                    upload_api_result = response.json()
-                    print(f"Frontend: Initial upload response: {upload_api_result}")
-                except Exception as e:
-                    upload_error = e
-                    print(f"Frontend: Upload exception: {e}")
-
-            # --- Process API Result / Error *AFTER* Spinner ---
-            if upload_api_result:
-                sid=upload_api_result.get("session_id"); bs=upload_api_result.get("status")
-                if sid and bs=="processing":
-                    st.session_state.session_id = sid
-                    st.session_state.upload_status_message = upload_api_result.get("message","✅ Files accepted. Processing started...")
-                    st.session_state.upload_status_type = "info"
-                    st.session_state.poll_active = True # *** Enable polling ***
-                    print(f"Frontend: Upload success. Session: {sid}. Poll Active: True")
-                else:
-                    st.session_state.upload_status_message = f"❌ Upload Error: {upload_api_result.get('message','Backend issue')}"
-                    st.session_state.upload_status_type = "error"
-                    st.session_state.poll_active = False
-                    st.session_state.session_id = None
-            elif upload_error:
-                 st.session_state.upload_status_message = f"❌ Upload Request Error: {upload_error}"
-                 st.session_state.upload_status_type = "error"
-                 st.session_state.poll_active = False
-                 st.session_state.session_id = None
-
-            # Rerun ONLY AFTER processing the upload response and setting state
+            st.session_state.uploaded_file_sig = current_sig
+
+            # Size gate before any network I/O: oversize files would be sent in full only to be rejected
+            oversize = [f.name for f in uploaded_files if f.size > MAX_UPLOAD_BYTES]
+            if oversize:
+                st.session_state.upload_status_message = f"❌ File(s) over the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit: {', '.join(oversize)}"
+                st.session_state.upload_status_type = "error"
+                st.rerun()
+            total_bytes = sum(f.size for f in uploaded_files)
+
+            # Upload runs in a background thread so the script (and every widget) isn't blocked on the POST;
+            # the block below picks up the result on a later rerun
+            st.session_state.upload_slot = {}
+            threading.Thread(target=_do_upload, args=(get_http_session(), list(uploaded_files), st.session_state.upload_slot), daemon=True).start()
+            st.session_state.upload_status_message = f"Uploading {len(uploaded_files)} file(s)..."
+            if total_bytes > MAX_TOTAL_UPLOAD_BYTES: st.session_state.upload_status_message += f" ({total_bytes / (1024 * 1024):.0f} MB total, this may take a while)"
             st.rerun()
 
         elif not uploaded_files and st.session_state.uploaded_file_names: # Files were removed
-             print("Frontend: Files removed. Clearing session.")
-             st.session_state.clear() # Clear everything if files are removed
+             logger.info("Files removed. Clearing session.")
+             _reset_app_state() # Clear the session if files are removed
              st.session_state.upload_status_message = "Upload documents to begin." # Reset message
              st.session_state.upload_status_type = "info"
              st.rerun() # Rerun to reflect cleared state
 
 
-    # --- Status Display & Polling Logic ---
-    # This block runs on every script run if polling is active
+    # --- Background Upload Result ---
+    upload_slot = st.session_state.get('upload_slot')
+    if upload_slot is not None:
+        if not upload_slot.get("done"):
+            st.info(st.session_state.get('upload_status_message') or "Uploading...", icon="⏳")
+            if upload_slot.get("bytes_total"): st.progress(min(1.0, upload_slot["bytes_sent"] / upload_slot["bytes_total"]))
+            elif upload_slot.get("files_total"): st.progress(upload_slot.get("files_sent", 0) / upload_slot["files_total"], text=f"{upload_slot.get('files_sent', 0)}/{upload_slot['files_total']} files")
+            time.sleep(1) # Check again shortly
+            st.rerun()
+        st.session_state.upload_slot = None
+        _apply_upload_result(upload_slot.get("result"), upload_slot.get("error"))
+        # Rerun ONLY AFTER processing the upload response and setting state
+        st.rerun()
+
+    # --- Status Display & Streaming Logic ---
+    # Holds one streamed GET open and updates the placeholder per event; the script reruns once, on the terminal state
     status_placeholder = st.empty()
-    if st.session_state.get('poll_active') and not st.session_state.get('processing_complete'):
+    ss = st.session_state # Bound once for the status block (every access otherwise goes through the SessionStateProxy)
+    if ss.get('poll_active') and not ss.get('processing_complete'):
         # Display current status message while polling
         with status_placeholder.container():
-             msg = st.session_state.get('upload_status_message','Polling status...')
-             st_type = st.session_state.get('upload_status_type','info')
+             msg = ss.get('upload_status_message','Polling status...')
+             st_type = ss.get('upload_status_type','info')
              st.info(msg,icon="⏳") if st_type == "info" else st.error(msg,icon="❌")
 
-        # Perform status check
-        status_result = check_backend_status(st.session_state.get('session_id'))
+        # Follow the status stream; fall back to a single poll if it can't be opened or drops
+        status_result = None; stream_stalled = False
+        try:
+            for event in stream_backend_status(ss.get('session_id')):
+                if event is not None: status_result = event; msg = event.get("message") or msg
+                # Redrawn on keep-alives too: without an st.* call here, Clear Session and other widgets wait on the stream
+                if status_result is None or status_result.get("status") == "processing":
+                    with status_placeholder.container(): st.info(msg, icon="⏳")
+        except Exception as e:
+            if _is_read_timeout(e): stream_stalled = True
+            else:
+                logger.warning("Status stream failed (%s). Falling back to long-polling.", e)
+                status_result = check_backend_status(ss.get('session_id'), wait=STATUS_LONG_POLL_SECONDS)
+        if stream_stalled: logger.info("Status stream went quiet; reopening it."); st.rerun()
 
         # --- Process Status Result - CORRECTED INDENTATION ---
         if status_result: # Check if status_result is not None
@@ -172,125 +445,144 @@ with st.sidebar:
             current_message = status_result.get("message")
 
             # Update status message if backend provides a more specific one during processing
-            if current_status == "processing" and current_message and current_message != st.session_state.get('upload_status_message'):
-                st.session_state.upload_status_message = current_message
+            if current_status == "processing" and current_message and current_message != ss.get('upload_status_message'):
+                ss.upload_status_message = current_message
 
             # Check for final states
             if current_status == "ready":
-                print(f"Frontend: Polling detected 'ready' status.")
-                st.session_state.processing_complete = True
-                st.session_state.poll_active = False
-                st.session_state.upload_status_message = current_message or "✅ Processing complete! Ready for questions."
-                st.session_state.upload_status_type = "success"
+                logger.info("Polling detected 'ready' status.")
+                ss.processing_complete = True
+                ss.poll_active = False
+                ss.upload_status_message = current_message or "✅ Processing complete! Ready for questions."
+                ss.upload_status_type = "success"
                 status_placeholder.empty() # Clear the placeholder
                 st.rerun() # Rerun to show final success and enable chat
 
             elif current_status == "error":
-                 print(f"Frontend: Polling detected 'error' status.")
-                 st.session_state.processing_complete = False
-                 st.session_state.poll_active = False
-                 st.session_state.upload_status_message = f"❌ Processing failed: {current_message or 'Unknown backend error.'}"
-                 st.session_state.upload_status_type = "error"
+                 logger.info("Polling detected 'error' status.")
+                 ss.processing_complete = False
+                 ss.poll_active = False
+                 ss.upload_status_message = f"❌ Processing failed: {current_message or 'Unknown backend error.'}"
+                 ss.upload_status_type = "error"
                  status_placeholder.empty()
                  st.rerun() # Rerun to show final error
 
             elif current_status == "processing":
-                 # Still processing, schedule next check
-                 print(f"Frontend: Polling status is '{current_status}'. Waiting...")
-                 time.sleep(3) # Wait 3 seconds before next check
+                 # Only reached when the stream ended early. The long-poll normally did the waiting; this backoff (0.5 s doubling
+                 # to 8 s, reset on progress) only matters when the server answers immediately (e.g. 404 while starting)
+                 interval = ss.poll_interval
+                 if current_message != ss.poll_last_msg: interval = POLL_INTERVAL_MIN; ss.poll_last_msg = current_message
+                 logger.debug("Polling status is '%s'. Waiting %.1fs...", current_status, interval)
+                 time.sleep(interval + random.uniform(0, interval * 0.1))
+                 ss.poll_interval = min(interval * 2, POLL_INTERVAL_MAX)
                  st.rerun() # Trigger next poll cycle
 
             else: # Handle timeout, not_found, or other unexpected statuses
-                 print(f"Frontend: Polling received unexpected status '{current_status}'. Stopping poll.")
-                 st.session_state.upload_status_message = f"⚠️ Status Check Issue: {current_message or current_status}"
-                 st.session_state.upload_status_type = "warning"
-                 st.session_state.poll_active = False
+                 logger.warning("Polling received unexpected status '%s'. Stopping poll.", current_status)
+                 ss.upload_status_message = f"⚠️ Status Check Issue: {current_message or current_status}"
+                 ss.upload_status_type = "warning"
+                 ss.poll_active = False
                  status_placeholder.empty()
                  st.rerun()
         else: # check_backend_status returned None (should be rare)
-             print(f"Frontend: Status check failed critically. Stopping poll.")
-             st.session_state.upload_status_message = "⚠️ Could not retrieve processing status from backend."
-             st.session_state.upload_status_type = "warning"
-             st.session_state.poll_active = False
+             logger.error("Status check failed critically. Stopping poll.")
+             ss.upload_status_message = "⚠️ Could not retrieve processing status from backend."
+             ss.upload_status_type = "warning"
+             ss.poll_active = False
              st.rerun() # Stop polling
         # --- END CORRECTED INDENTATION BLOCK ---
 
 
     # Display final status message if polling is finished
-    if not st.session_state.get('poll_active') and st.session_state.get('upload_status_message'):
+    if not ss.get('poll_active') and ss.get('upload_status_message'):
          with status_placeholder.container():
-             msg = st.session_state.get('upload_status_message')
-             st_type = st.session_state.get('upload_status_type')
+             msg = ss.get('upload_status_message')
+             st_type = ss.get('upload_status_type')
              if st_type == "success": st.success(msg, icon="✅")
              elif st_type == "error": st.error(msg, icon="❌")
              elif st_type == "warning": st.warning(msg, icon="⚠️")
-             elif st_type == "info" and st.session_state.get('processing_complete'): # Show success if polling stopped but processing is done
+             elif st_type == "info" and ss.get('processing_complete'): # Show success if polling stopped but processing is done
                  st.success(msg.replace("Processing started...","Processing complete!"), icon="✅")
 
 
     # Display uploaded files list Expander
     if st.session_state.get('session_id'): # Show expander only if a session is active
-        expander_title = "Uploaded Files"; status_icon = ""
-        pc = st.session_state.get('processing_complete', False); pa = st.session_state.get('poll_active', False); ust = st.session_state.get('upload_status_type', 'info')
-        if not pc and pa: expander_title += " (Processing...)"; status_icon="⏳"
-        elif pc and ust != 'error': expander_title += " (Ready)"; status_icon="✅"
-        elif ust == 'error': expander_title += " (Error)"; status_icon="❌"
-        expand_default = pa or ust == 'success'
-        with st.expander(f"{status_icon} {expander_title}", expanded=expand_default):
+        state_key = (st.session_state.get('processing_complete', False), st.session_state.get('poll_active', False), st.session_state.get('upload_status_type', 'info'))
+        expander_label, expand_default = _expander_states().get(state_key) or _files_expander_state(*state_key)
+        with st.expander(expander_label, expanded=expand_default):
              uploaded_file_list = st.session_state.get('uploaded_file_names', [])
-             if uploaded_file_list:
-                 # --- Corrected Loop ---
-                 for name in uploaded_file_list:
-                     st.caption(name)
-                 # --- END Correction ---
+             if uploaded_file_list: st.markdown(_files_markdown(tuple(uploaded_file_list))) # One element, not one caption per file
              else:
                   st.caption("No files associated with this session.")
 
     # --- Clear Button ---
     st.markdown("---");
-    if st.button("Clear Session & Start Over",key="clear"): st.session_state.clear(); st.rerun()
+    if st.button("Clear Session & Start Over",key="clear"): _reset_app_state(); st.rerun()
     st.markdown("---"); st.caption(f"Backend API: {BACKEND_URL}")
 
 # --- Chat Interface ---
+def _render_message(msg):
+    with st.chat_message(msg["role"]):
+        st.markdown(msg["content"])
+        if msg["role"]=="assistant" and msg.get("type") != "error" and msg.get("sources"):
+            display_sources(msg.get("sources",[]))
+
+def _trim_history():
+    """Keeps st.session_state.messages to the last HISTORY_WINDOW entries, moving older ones to messages_archive (a bounded deque)."""
+    overflow = len(st.session_state.messages) - HISTORY_WINDOW
+    if overflow > 0:
+        st.session_state.messages_archive.extend(st.session_state.messages[:overflow])
+        del st.session_state.messages[:overflow]
+
+@_fragment
+def render_history():
+    """Displays existing messages from session state. As a fragment it can rerun on its own, without the sidebar."""
+    older, recent = st.session_state.get('messages_archive',[]), st.session_state.get('messages',[])
+    # Older turns only render on request (a toggle, not an expander: a collapsed expander still runs its body)
+    if older and st.toggle(f"Show {len(older)} earlier messages", key="show_older_messages"):
+        for msg in older: _render_message(msg)
+    for msg in recent: _render_message(msg)
+
 message_container = st.container() # Use a container for messages
-with message_container:
-    # Display existing messages from session state
-    for msg in st.session_state.get('messages',[]):
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-            if msg["role"]=="assistant" and msg.get("type") != "error" and msg.get("sources"):
-                display_sources(msg.get("sources",[]))
-
-# Define chat input - disable based on processing_complete state
-prompt = st.chat_input("Ask a question...",
-                       disabled=not st.session_state.get('processing_complete', False),
-                       key="chat_input")
-
-# Logic to handle prompt submission
-if prompt:
-    cleaned_prompt = prompt.strip()
-    if not cleaned_prompt: st.warning("Enter question.")
-    elif not st.session_state.get('session_id'): st.error("No session.")
-    else: st.session_state.messages.append({"role":"user","content":cleaned_prompt,"type":"text"}); st.rerun()
-
-# Logic to generate assistant response if the last message was from the user
-if st.session_state.get('messages') and st.session_state.messages[-1]["role"] == "user":
-    last_user_message = st.session_state.messages[-1]["content"]
-    with st.chat_message("assistant"):
-        mp = st.empty(); mp.markdown("Thinking... ▌"); fc = ""; srcs = []; rt = "error"
-        try:
-            pld={"question":last_user_message,"session_id":st.session_state.session_id}; r=requests.post(ASK_ENDPOINT,json=pld,timeout=180); r.raise_for_status(); res=r.json()
-            fc=res.get("answer","Error"); rt=res.get("type","error"); srcs=res.get("sources",[])
-        except Exception as e:
-            sc="N/A"; ed="(No details)"
-            if 'r' in locals() and hasattr(r, 'status_code'): sc=r.status_code;
-            try: ed=r.json().get("detail",r.text)
-            except: pass
-            fc=f"❌ Ask Error: {e}\nBE:{ed}\nStatus:{sc}"; rt="error"
-        # Append message state *before* displaying it fully
-        st.session_state.messages.append({"role":"assistant","content":fc,"type":rt,"sources":srcs if rt!="error" else []})
-        # Now update the placeholder with the final content
-        mp.empty() # Clear thinking indicator
-        st.markdown(fc)
-        if rt != "error": display_sources(srcs)
-        # No rerun needed here as we displayed manually after appending state
\ No newline at end of file
+with message_container: render_history()
+
+def _on_prompt_submit():
+    """chat_input on_submit: validates before the run starts, so the main flow only ever sees a clean prompt (or an error)."""
+    cleaned = (st.session_state.get("chat_input") or "").strip()
+    if not cleaned: st.session_state.prompt_error = ("warning", "Enter question.")
+    elif not st.session_state.get('session_id'): st.session_state.prompt_error = ("error", "No session.")
+    else: st.session_state.pending_prompt = cleaned
+
+# Chat input only exists once processing is complete; until then a static caption (no widget to register on every rerun)
+if st.session_state.get('processing_complete', False): st.chat_input("Ask a question...", key="chat_input", on_submit=_on_prompt_submit)
+else: st.caption("⏳ Chat becomes available once your documents are processed.")
+
+# Logic to handle prompt submission: the user message and the answer are drawn in this same run (no rerun per turn)
+prompt_error = st.session_state.pop("prompt_error", None); cleaned_prompt = st.session_state.pop("pending_prompt", None)
+if prompt_error: getattr(st, prompt_error[0])(prompt_error[1])
+elif cleaned_prompt:
+    user_message = {"role":"user","content":cleaned_prompt,"type":"text"}
+    with message_container:
+        _render_message(user_message)
+        with st.chat_message("assistant"):
+            mp = st.empty(); mp.markdown("Thinking... ▌"); fc = ""; srcs = []; rt = "error"
+            try:
+                memo_key=(st.session_state.session_id, cleaned_prompt) # Same question against a new upload is a new question
+                res=st.session_state.answer_memo.get(memo_key)
+                if res is None:
+                    try: res=ask_streaming(st.session_state.session_id, cleaned_prompt, mp)
+                    except requests.exceptions.HTTPError as e:
+                        if e.response is None or e.response.status_code not in (404, 405): raise
+                        res=ask_in_background(st.session_state.session_id, cleaned_prompt, mp) # Backend without /ask/stream
+                fc=res.get("answer","Error"); rt=res.get("type","error"); srcs=res.get("sources",[])
+                if rt != "error": st.session_state.answer_memo[memo_key]=res # Failures aren't memoized; the next ask retries
+            except Exception as e:
+                er=getattr(e, "response", None); sc=er.status_code if er is not None else "N/A"
+                fc=f"❌ Ask Error: {e}\nBE:{_err_detail(er)}\nStatus:{sc}"; rt="error"
+            # Both turns are committed to history together, once the answer is complete (an interrupted run leaves no orphan)
+            st.session_state.messages.extend([user_message, {"role":"assistant","content":fc,"type":rt,"sources":srcs if rt!="error" else []}])
+            _trim_history()
+            # Now update the placeholder with the final content
+            mp.empty() # Clear thinking indicator
+            st.markdown(fc)
+            if rt != "error": display_sources(srcs)